@@ -0,0 +1,39 @@
+### Measures the throughput of the training data pipeline alone (no model), e.g.
+### python benchmark_loader.py --dataroot ... --gpu_ids -1 --nThreads 4 --persistent_workers --bench_batches 100
+import time
+import torch
+from options.train_options import TrainOptions
+from data.custom_dataset_data_loader import CustomDatasetDataLoader
+from data.base_dataset import augment_batch
+
+options = TrainOptions()
+options.initialize()
+options.parser.add_argument('--bench_batches', type=int, default=50, help='batches timed per epoch')
+options.parser.add_argument('--bench_epochs', type=int, default=3, help='epochs timed, the first one includes the worker start-up')
+opt = options.parse(save=False)
+device = 'cuda' if len(opt.gpu_ids) > 0 else 'cpu'
+
+data_loader = CustomDatasetDataLoader()
+data_loader.initialize(opt)
+dataset = data_loader.load_data()
+
+for epoch in range(opt.bench_epochs):
+    epoch_start_time = time.time()
+    first_batch_time = None
+    samples = 0
+    for i, data in enumerate(dataset):
+        if opt.gpu_augment:
+            augment_batch(opt, data, device)
+        for key in ('label', 'image', 'next_label', 'next_image'):
+            if torch.is_tensor(data[key]):
+                data[key] = data[key].to(device, non_blocking=True)
+        samples += data['label'].shape[0]
+        if first_batch_time is None:
+            first_batch_time = time.time() - epoch_start_time
+        if i + 1 == opt.bench_batches:
+            break
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = time.time() - epoch_start_time
+    print('epoch %d: %d samples in %.2f sec, %.1f samples/sec, first batch after %.2f sec' %
+          (epoch, samples, elapsed, samples / elapsed, first_batch_time))
@@ -4,43 +4,99 @@ import os.path
 import random
 import torchvision.transforms as transforms
 import torch
-from data.base_dataset import BaseDataset, get_params, get_transform, normalize
-from data.image_folder import make_dataset
+from data.base_dataset import BaseDataset, get_params, get_transform, get_transform_key, get_resized_size, resize_frame, frame_to_tensor, normalize
+from data.frame_cache import FrameCache
+from data.image_folder import make_dataset, make_dataset_manifest
 from PIL import Image
 import numpy as np
 import joblib
 import cv2
 
+# per-frame fields of the VIBE result, also the file names of the columnar store
+VIBE_FIELDS = ['bboxes', 'pred_cam', 'orig_cam', 'pose', 'betas', 'verts', 'joints3d', 'frame_ids', 'kp_2d']
+
+def get_param_fields(opt):
+    """Fields of other_params/next_other_params loaded for every training sample."""
+    if opt.param_fields:
+        return opt.param_fields.split(',')
+
+    # the bbox crops the PixMAF features
+    fields = ['bboxes']
+    # frame ids index the best fits, openpose keypoints supervise the reprojection and the SMPLify fits
+    if opt.use_pixmaf or opt.run_smplify:
+        fields += ['frame_ids', 'openpose_kp_2d']
+    if opt.use_pixmaf and opt.use_silhouette:
+        fields += ['silhouette']
+    return fields
+
 class AlignedDataset(BaseDataset):
     def initialize(self, opt):
         self.opt = opt
         self.root = opt.dataroot
         # stage决定bbox的大小
         self.stage = opt.netG     
+        # decoded frames shared by the current and the next frame loads
+        self.frame_cache = FrameCache(opt.frame_cache_mb * 2**20) if opt.frame_cache_mb > 0 else None
+        # yield raw uint8 frames, crop/flip/normalize run batched in augment_batch
+        self.gpu_augment = opt.isTrain and opt.gpu_augment
+        # per-frame keys of the transformed real images for the VGG feature cache
+        self.frame_keys = opt.isTrain and opt.vgg_cache_mb > 0
+
+        if opt.manifest:
+            # one cached, alignment-checked listing of every folder read below
+            self.manifest = make_dataset_manifest(opt.dataroot, self.manifest_dirs(opt),
+                                                  os.path.join(opt.dataroot, opt.phase + '_manifest.json'))
 
         ### label maps    
         self.dir_label = os.path.join(opt.dataroot, opt.phase + '_label')              
-        self.label_paths = sorted(make_dataset(self.dir_label))
+        self.label_paths = self.list_frames(self.dir_label)
+        if opt.frame_pack:
+            self.label_pack = self.open_pack(self.dir_label, self.label_paths)
 
         ### real images
         if opt.isTrain:
             self.dir_image = os.path.join(opt.dataroot, opt.phase + '_img')  
-            self.image_paths = sorted(make_dataset(self.dir_image))
+            self.image_paths = self.list_frames(self.dir_image)
+            if opt.frame_pack:
+                self.image_pack = self.open_pack(self.dir_image, self.image_paths)
 
-            self.file_vibe = os.path.join(opt.dataroot, 'train_vibe.pkl')  
-            self.vibe_results = joblib.load(self.file_vibe)
+            # only the other_params fields used by the enabled losses are read
+            self.param_fields = get_param_fields(opt)
 
-            self.file_kp2d = os.path.join(opt.dataroot, 'openpose_kps_for_pixmaf/openpose_kps_20606_norm.npy')
-            self.kp2d = np.load(self.file_kp2d)
+            vibe_fields = [k for k in VIBE_FIELDS if k in self.param_fields]
+            if opt.vibe_mmap:
+                # one .npy per field, see data_prep/convert_vibe.py
+                self.dir_vibe = os.path.join(opt.dataroot, 'train_vibe')
+                self.vibe = {k: np.load(os.path.join(self.dir_vibe, k + '.npy'), mmap_mode='r') for k in vibe_fields}
+            elif vibe_fields:
+                self.file_vibe = os.path.join(opt.dataroot, 'train_vibe.pkl')  
+                self.vibe = joblib.load(self.file_vibe)[1]
 
-            self.dir_silhouettes = os.path.join(opt.dataroot, 'georges_sil_binary_384_384')
-            self.silhouettes_paths = sorted(make_dataset(self.dir_silhouettes))
+            if 'openpose_kp_2d' in self.param_fields:
+                self.file_kp2d = os.path.join(opt.dataroot, 'openpose_kps_for_pixmaf/openpose_kps_20606_norm.npy')
+                self.kp2d = np.load(self.file_kp2d)
+
+            if 'silhouette' in self.param_fields:
+                self.dir_silhouettes = os.path.join(opt.dataroot, 'georges_sil_binary_384_384')
+                if opt.silhouette_cache:
+                    # packed masks and distance fields, see data_prep/pack_silhouettes.py
+                    self.silhouettes = np.load(self.dir_silhouettes + '.npy', mmap_mode='r')
+                else:
+                    self.silhouettes_paths = self.list_frames(self.dir_silhouettes)
 
         ### load face bounding box coordinates size 128x128
         if opt.face_discrim or opt.face_generator:
             self.dir_facetext = os.path.join(opt.dataroot, opt.phase + '_facetexts128')
             print('----------- loading face bounding boxes from %s ----------' % self.dir_facetext)
-            self.facetext_paths = sorted(make_dataset(self.dir_facetext))
+            self.face_boxes = None
+            if os.path.exists(os.path.join(self.dir_facetext, 'face_boxes.npy')):
+                # all boxes in one array, written by the data_prep scripts and pack_face_boxes.py
+                self.face_boxes = np.load(os.path.join(self.dir_facetext, 'face_boxes.npy')).astype(np.int32)
+                if len(self.face_boxes) != len(self.label_paths):
+                    print('face_boxes.npy has %d boxes for %d frames, reading the txt files' % (len(self.face_boxes), len(self.label_paths)))
+                    self.face_boxes = None
+            if self.face_boxes is None:
+                self.facetext_paths = self.list_frames(self.dir_facetext)
 
 
         self.dataset_size = len(self.label_paths) 
@@ -50,46 +106,24 @@ class AlignedDataset(BaseDataset):
         #     print('skip last image.')
         #     index =  random.randint(0,len(self) - 2)          
         ### label maps
-        paths = self.label_paths
-        label_path = paths[index]              
-        label = Image.open(label_path).convert('RGB')        
-        params = get_params(self.opt, label.size)
-        transform_label = get_transform(self.opt, params, method=Image.NEAREST, normalize=False)
-        label_tensor = transform_label(label)
-        original_label_path = label_path
+        original_label_path = self.label_paths[index]
+        params = get_params(self.opt, self.frame_size(index))
+        label_tensor = self.load_frame(index, params, is_label=True)
 
         image_tensor = next_label = next_image = face_tensor = 0
         other_params = {}
         next_other_params = {}
+        crop_params = self.crop_params(params)
+        next_crop_params = {}
+        # host side keys of the VGG feature cache, kept out of other_params which go to the device
+        vgg_keys = {'frame': '', 'next_frame': '', 'face': ''}
         ### real images 
         if self.opt.isTrain:
-            image_path = self.image_paths[index]   
-            image = Image.open(image_path).convert('RGB')    
-            transform_image = get_transform(self.opt, params)     
-            image_tensor = transform_image(image).float()
-
-            # 添加bbox
-            # 针对[256,512]，要减半
-            if self.stage == 'global':
-                other_params['bboxes'] = np.multiply(self.vibe_results[1]['bboxes'][index],np.array([0.5, 0.5, 0.55, 0.55])) # torch.Size([1, 4])
-            elif self.stage == 'local':
-                other_params['bboxes'] = np.multiply(self.vibe_results[1]['bboxes'][index],np.array([1., 1., 1.1, 1.1])) # torch.Size([1, 4])
-
-            # ununsed
-            other_params['pred_cam'] = self.vibe_results[1]['pred_cam'][index] # torch.Size([1, 3])
-            other_params['orig_cam'] = self.vibe_results[1]['orig_cam'][index]
-            other_params['pose'] = self.vibe_results[1]['pose'][index] # torch.Size([1, 72])
-            other_params['betas'] = self.vibe_results[1]['betas'][index] # torch.Size([1, 10])   
-            other_params['verts'] = self.vibe_results[1]['verts'][index] # torch.Size([1, 6890, 3])
-            other_params['joints3d'] = self.vibe_results[1]['joints3d'][index] # torch.Size([1, 49, 3])
-            other_params['frame_ids'] = self.vibe_results[1]['frame_ids'][index]
-            other_params['kp_2d'] = self.vibe_results[1]['kp_2d'][index]
-
-            # pseudo-gt openpose keypoint 
-            other_params['openpose_kp_2d'] = self.kp2d[index] # torch.Size([1, 25, 3])
-
-            # pseudo-gt silhouette image
-            other_params['silhouette'] = torch.from_numpy(cv2.imread(self.silhouettes_paths[index],cv2.IMREAD_GRAYSCALE))
+            image_tensor = self.load_frame(index, params)
+
+            self.load_params(other_params, index)
+            if self.frame_keys:
+                vgg_keys['frame'] = self.frame_key(index, params)
 
         is_next = index < len(self) - 1
         if self.opt.gestures:
@@ -97,53 +131,136 @@ class AlignedDataset(BaseDataset):
 
         """ Load the next label, image pair """
         if is_next:
-            paths = self.label_paths
-            label_path = paths[index+1]              
-            label = Image.open(label_path).convert('RGB')        
-            params = get_params(self.opt, label.size)          
-            transform_label = get_transform(self.opt, params, method=Image.NEAREST, normalize=False)
-            next_label = transform_label(label).float()
+            params = get_params(self.opt, self.frame_size(index+1))
+            next_label = self.load_frame(index+1, params, is_label=True)
+            next_crop_params = self.crop_params(params)
             
             if self.opt.isTrain:
-                image_path = self.image_paths[index+1]   
-                image = Image.open(image_path).convert('RGB')
-                # 用0.5来 normalize
-                transform_image = get_transform(self.opt, params)      
-                next_image = transform_image(image).float()
+                next_image = self.load_frame(index+1, params)
 
-                # 添加bbox
-                if self.stage == 'global':
-                    next_other_params['bboxes'] = np.multiply(self.vibe_results[1]['bboxes'][index+1],np.array([0.5, 0.5, 0.55, 0.55])) # torch.Size([1, 4])
-                elif self.stage == 'local':
-                    next_other_params['bboxes'] = np.multiply(self.vibe_results[1]['bboxes'][index+1],np.array([1., 1., 1.1, 1.1])) # torch.Size([1, 4])
-
-                # ununsed
-                next_other_params['pred_cam'] = self.vibe_results[1]['pred_cam'][index+1] 
-                next_other_params['orig_cam'] = self.vibe_results[1]['orig_cam'][index+1]
-                next_other_params['pose'] = self.vibe_results[1]['pose'][index+1] 
-                next_other_params['betas'] = self.vibe_results[1]['betas'][index+1] 
-                next_other_params['verts'] = self.vibe_results[1]['verts'][index+1] 
-                next_other_params['joints3d'] = self.vibe_results[1]['joints3d'][index+1] 
-                next_other_params['frame_ids'] = self.vibe_results[1]['frame_ids'][index+1]
-                next_other_params['kp_2d'] = self.vibe_results[1]['kp_2d'][index+1]
-
-                # gt openpose keypoint 
-                next_other_params['openpose_kp_2d'] = self.kp2d[index+1]
-
-                # pseudo-gt silhouette image
-                next_other_params['silhouette'] = torch.from_numpy(cv2.imread(self.silhouettes_paths[index+1],cv2.IMREAD_GRAYSCALE))
+                self.load_params(next_other_params, index+1)
+                if self.frame_keys:
+                    vgg_keys['next_frame'] = self.frame_key(index+1, params)
 
         """ If using the face generator and/or face discriminator """
         if self.opt.face_discrim or self.opt.face_generator:
-            facetxt_path = self.facetext_paths[index]
-            facetxt = open(facetxt_path, "r")
-            face_tensor = torch.IntTensor(list([int(coord_str) for coord_str in facetxt.read().split()]))
+            if self.face_boxes is not None:
+                face_tensor = torch.from_numpy(self.face_boxes[index])
+            else:
+                facetxt_path = self.facetext_paths[index]
+                facetxt = open(facetxt_path, "r")
+                face_tensor = torch.IntTensor(list([int(coord_str) for coord_str in facetxt.read().split()]))
 
-        input_dict = {'label': label_tensor.float(), 'image': image_tensor, 'other_params':other_params,
+        input_dict = {'label': label_tensor, 'image': image_tensor, 'other_params':other_params,
                       'path': original_label_path, 'face_coords': face_tensor,
                       'next_label': next_label, 'next_image': next_image, 'next_other_params':next_other_params }
+        if self.frame_keys:
+            if self.opt.face_discrim:
+                vgg_keys['face'] = ':face:' + ':'.join(str(int(c)) for c in face_tensor[:4])
+            input_dict['vgg_keys'] = vgg_keys
+        if self.gpu_augment:
+            input_dict['crop_params'] = crop_params
+            input_dict['next_crop_params'] = next_crop_params
         return input_dict
 
+    def manifest_dirs(self, opt):
+        dirs = [opt.phase + '_label']
+        if opt.isTrain:
+            dirs.append(opt.phase + '_img')
+            if 'silhouette' in get_param_fields(opt) and not opt.silhouette_cache:
+                dirs.append('georges_sil_binary_384_384')
+        face_dir = os.path.join(opt.dataroot, opt.phase + '_facetexts128')
+        if (opt.face_discrim or opt.face_generator) and not os.path.exists(os.path.join(face_dir, 'face_boxes.npy')):
+            dirs.append(opt.phase + '_facetexts128')
+        return dirs
+
+    def list_frames(self, frame_dir):
+        if self.opt.manifest:
+            return self.manifest[os.path.basename(frame_dir)]
+        return sorted(make_dataset(frame_dir))
+
+    def frame_key(self, index, params):
+        # frame index and the part of params that changes the real image, see VGGFeatureCache.
+        # A string, so that it stays on the host when the batch goes to the device
+        return ':'.join(str(int(p)) for p in (index,) + tuple(get_transform_key(self.opt, params)))
+
+    def crop_params(self, params):
+        return {'crop_pos': torch.IntTensor(params['crop_pos']), 'flip': params['flip']}
+
+    def open_pack(self, frame_dir, paths):
+        # pre-resized frames, see data_prep/pack_frames.py
+        index = np.load(frame_dir + '.index.npy')
+        frames = np.memmap(frame_dir + '.pack', dtype=np.uint8, mode='r')
+        assert len(index) == len(paths), '%s has %d frames, %s has %d' % (frame_dir + '.pack', len(index), frame_dir, len(paths))
+        size = get_resized_size(self.opt, Image.open(paths[0]).size)
+        assert size == (index[0]['width'], index[0]['height']), \
+            '%s was packed for another --loadSize/--resize_or_crop' % (frame_dir + '.pack')
+        return frames, index
+
+    def frame_size(self, index):
+        if self.opt.frame_pack:
+            # get_params gives the same crop range for the resized size
+            return int(self.label_pack[1][index]['width']), int(self.label_pack[1][index]['height'])
+        return Image.open(self.label_paths[index]).size
+
+    def load_frame(self, index, params, is_label=False):
+        # the cache holds the resized frame, crop and flip run after the lookup so that
+        # every augmentation of a frame hits the same entry
+        if self.opt.frame_pack:
+            frame = self.pack_frame(index, is_label)
+        elif self.frame_cache is None:
+            frame = self.decode_frame(index, is_label)
+        else:
+            frame = self.frame_cache.get((index, is_label), lambda: self.decode_frame(index, is_label))
+        if self.gpu_augment:
+            return torch.from_numpy(np.array(frame)).permute(2, 0, 1)
+        return frame_to_tensor(self.opt, frame, params, normalize=not is_label)
+
+    def pack_frame(self, index, is_label):
+        # a view into the memory-mapped pack, already resized
+        frames, frame_index = self.label_pack if is_label else self.image_pack
+        offset, height, width = frame_index[index]
+        return frames[offset:offset + height * width * 3].reshape(height, width, 3)
+
+    def decode_frame(self, index, is_label):
+        """Returns the (H, W, 3) uint8 frame after the resize step of get_transform."""
+        img = Image.open(self.label_paths[index] if is_label else self.image_paths[index]).convert('RGB')
+        return np.array(resize_frame(self.opt, img, Image.NEAREST if is_label else Image.BICUBIC))
+
+    def load_params(self, params, index):
+        for key in self.param_fields:
+            if key == 'bboxes':
+                # 添加bbox
+                # 针对[256,512]，要减半
+                if self.stage == 'global':
+                    params['bboxes'] = np.multiply(self.get_vibe('bboxes', index),np.array([0.5, 0.5, 0.55, 0.55])) # torch.Size([1, 4])
+                elif self.stage == 'local':
+                    params['bboxes'] = np.multiply(self.get_vibe('bboxes', index),np.array([1., 1., 1.1, 1.1])) # torch.Size([1, 4])
+            elif key == 'openpose_kp_2d':
+                # pseudo-gt openpose keypoint 
+                params['openpose_kp_2d'] = self.kp2d[index] # torch.Size([1, 25, 3])
+            elif key == 'silhouette':
+                # pseudo-gt silhouette image
+                self.load_silhouette(params, index)
+            else:
+                # pred_cam [3], orig_cam [4], pose [72], betas [10], verts [6890, 3], joints3d [49, 3], frame_ids, kp_2d
+                params[key] = self.get_vibe(key, index)
+
+    def get_vibe(self, key, index):
+        # copy the row out of the (possibly memory-mapped) array
+        return np.array(self.vibe[key][index])
+
+    def load_silhouette(self, params, index):
+        if self.opt.silhouette_cache:
+            record = self.silhouettes[index]
+            width = record['dist'].shape[-1]
+            params['silhouette'] = torch.from_numpy(np.unpackbits(record['mask'], axis=-1, count=width))
+            params['silhouette_dist'] = torch.from_numpy(np.array(record['dist']))
+        else:
+            path = self.silhouettes_paths[index]
+            load = lambda: torch.from_numpy(cv2.imread(path,cv2.IMREAD_GRAYSCALE))
+            params['silhouette'] = load() if self.frame_cache is None else self.frame_cache.get((path,), load)
+
     def __len__(self):
         return len(self.label_paths)
 
@@ -5,6 +5,7 @@ from PIL import Image
 import torchvision.transforms as transforms
 import numpy as np
 import random
+import torch
 
 class BaseDataset(data.Dataset):
     def __init__(self):
@@ -37,6 +38,15 @@ def get_params(opt, size, whocallme=''):
     flip = random.random() > 0.5
     return {'crop_pos': (x, y), 'flip': flip}
 
+def get_transform_key(opt, params):
+    """The part of params that changes the output of get_transform."""
+    key = ()
+    if 'crop' in opt.resize_or_crop:
+        key += tuple(params['crop_pos'])
+    if opt.isTrain and not opt.no_flip:
+        key += (params['flip'],)
+    return key
+
 def get_transform(opt, params, method=Image.BICUBIC, normalize=True, whocallme=''):
     transform_list = []
     storeload = opt.loadSize
@@ -70,6 +80,87 @@ def get_transform(opt, params, method=Image.BICUBIC, normalize=True, whocallme='
                                                 (0.5, 0.5, 0.5))]
     return transforms.Compose(transform_list)
 
+def get_resized_size(opt, size):
+    """Size (w, h) of a frame after the resize step of get_transform, i.e. before crop and flip."""
+    ow, oh = size
+    if 'resize' in opt.resize_or_crop:
+        return opt.loadSize, opt.loadSize
+    elif 'scale_width' in opt.resize_or_crop:
+        if ow == opt.loadSize:
+            return size
+        return opt.loadSize, int(opt.loadSize * oh / ow)
+    elif opt.resize_or_crop == 'none':
+        base = float(2 ** opt.n_downsample_global)
+        if opt.netG == 'local':
+            base *= (2 ** opt.n_local_enhancers)
+        return int(round(ow / base) * base), int(round(oh / base) * base)
+    return size
+
+def resize_frame(opt, img, method=Image.BICUBIC):
+    """The resize step of get_transform, used to pre-resize frames offline."""
+    size = get_resized_size(opt, img.size)
+    if size == img.size:
+        return img
+    return img.resize(size, method)
+
+def frame_to_tensor(opt, frame, params, normalize=True):
+    """Crop, flip and normalize of get_transform on a pre-resized (H, W, 3) uint8 array."""
+    if 'crop' in opt.resize_or_crop:
+        frame = __crop_array(frame, params['crop_pos'], opt.fineSize)
+    if opt.isTrain and not opt.no_flip and params['flip']:
+        frame = frame[:, ::-1]
+
+    # the only copy of the frame, the pack itself is read-only
+    tensor = torch.from_numpy(np.array(frame)).permute(2, 0, 1).float().div(255)
+    if normalize:
+        tensor = tensor.sub(0.5).div(0.5)
+    return tensor
+
+def augment_frames(opt, frames, params, normalize=True):
+    """Batched crop, flip and normalize of get_transform.
+    Input:
+        frames: (B, 3, H, W) uint8 pre-resized frames
+        params: collated get_params output, crop_pos (B, 2) and flip (B,)
+    Returns:
+        (B, 3, h, w) float tensor on the device of frames
+    """
+    if 'crop' in opt.resize_or_crop:
+        size = opt.fineSize
+        oh, ow = frames.shape[-2:]
+        if (ow > size or oh > size):
+            if (ow < size or oh < size):
+                # PIL pads crops outside the image with zeros
+                frames = torch.nn.functional.pad(frames, (0, max(0, size - ow), 0, max(0, size - oh)))
+            pos = params['crop_pos'].to(frames.device).long()
+            offset = torch.arange(size, device=frames.device)
+            rows = (pos[:, 1:2] + offset).unsqueeze(2)
+            cols = (pos[:, 0:1] + offset).unsqueeze(1)
+            batch = torch.arange(frames.shape[0], device=frames.device).view(-1, 1, 1)
+            frames = frames.permute(0, 2, 3, 1)[batch, rows, cols].permute(0, 3, 1, 2)
+
+    if opt.isTrain and not opt.no_flip:
+        flip = params['flip'].to(frames.device).view(-1, 1, 1, 1)
+        frames = torch.where(flip, frames.flip(-1), frames)
+
+    frames = frames.float().div(255)
+    if normalize:
+        frames = frames.sub(0.5).div(0.5)
+    return frames
+
+def augment_batch(opt, data, device='cuda'):
+    """Runs augment_frames on the label/image pairs of a batch yielded with --gpu_augment.
+    A pair shares its crop and flip, like the per-sample transforms."""
+    for label_key, image_key, params_key in (('label', 'image', 'crop_params'),
+                                             ('next_label', 'next_image', 'next_crop_params')):
+        params = data.pop(params_key)
+        if data[label_key].dim() < 4:
+            # no next frame
+            continue
+        data[label_key] = augment_frames(opt, data[label_key].to(device, non_blocking=True), params, normalize=False)
+        if data[image_key].dim() == 4:
+            data[image_key] = augment_frames(opt, data[image_key].to(device, non_blocking=True), params)
+    return data
+
 def normalize():    
     return transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
 
@@ -97,6 +188,17 @@ def __crop(img, pos, size):
         return img.crop((x1, y1, x1 + tw, y1 + th))
     return img
 
+def __crop_array(frame, pos, size):
+    oh, ow = frame.shape[:2]
+    x1, y1 = pos
+    if (ow > size or oh > size):
+        crop = frame[y1:y1 + size, x1:x1 + size]
+        if crop.shape[:2] != (size, size):
+            # PIL pads crops outside the image with zeros
+            crop = np.pad(crop, ((0, size - crop.shape[0]), (0, size - crop.shape[1]), (0, 0)), 'constant')
+        return crop
+    return frame
+
 def __flip(img, flip):
     if flip:
         return img.transpose(Image.FLIP_LEFT_RIGHT)
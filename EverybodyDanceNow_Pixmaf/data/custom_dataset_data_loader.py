@@ -1,5 +1,15 @@
 import torch.utils.data
 from data.base_data_loader import BaseDataLoader
+from data.frame_cache import ContiguousChunkSampler
+from data.prefetcher import DevicePrefetcher
+
+
+def loader_kwargs(opt):
+    kwargs = {'num_workers': int(opt.nThreads), 'pin_memory': opt.pin_memory}
+    if int(opt.nThreads) > 0:
+        kwargs['persistent_workers'] = opt.persistent_workers
+        kwargs['prefetch_factor'] = opt.prefetch_factor
+    return kwargs
 
 
 def CreateDataset(opt):
@@ -17,13 +27,19 @@ class CustomDatasetDataLoader(BaseDataLoader):
     def initialize(self, opt):
         BaseDataLoader.initialize(self, opt)
         self.dataset = CreateDataset(opt)
+        sampler = None
+        if opt.chunk_sampler > 0 and not opt.serial_batches:
+            sampler = ContiguousChunkSampler(self.dataset, opt.chunk_sampler, opt.batchSize, int(opt.nThreads))
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batchSize,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.nThreads))
+            shuffle=not opt.serial_batches and sampler is None,
+            sampler=sampler,
+            **loader_kwargs(opt))
 
     def load_data(self):
+        if self.opt.prefetch_device:
+            return DevicePrefetcher(self.dataloader, 'cuda' if len(self.opt.gpu_ids) > 0 else 'cpu')
         return self.dataloader
 
     def __len__(self):
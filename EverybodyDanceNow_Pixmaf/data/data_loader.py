@@ -3,7 +3,7 @@ from torch.utils.data import ConcatDataset, DataLoader
 from .amass import AMASS
 
 def CreateDataLoader(opt,cfg):
-    from data.custom_dataset_data_loader import CustomDatasetDataLoader
+    from data.custom_dataset_data_loader import CustomDatasetDataLoader, loader_kwargs
     data_loader = CustomDatasetDataLoader()
     print(data_loader.name())
     data_loader.initialize(opt)
@@ -16,7 +16,7 @@ def CreateDataLoader(opt,cfg):
             dataset=motion_disc_db,
             batch_size=opt.batchSize,
             shuffle=True,
-            num_workers=int(opt.nThreads),
+            **loader_kwargs(opt)
         )
         return data_loader, motion_disc_loader
     
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import random
+import numpy as np
+import torch.utils.data as data
+
+"""
+Decoded frame cache and a sampler that makes it useful.
+Sample i loads frames i and i+1, sample i+1 loads frames i+1 and i+2, so a serial pass decodes
+every label, image and silhouette twice. The dataset keeps the decoded, resized frames in a
+FrameCache and runs crop and flip after the lookup, so a frame hits whatever augmentation it
+gets the second time; DataLoader workers are forked, so every worker owns an independent cache.
+"""
+class FrameCache(object):
+    """LRU cache of decoded frames (tensors or arrays) with a byte budget."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """Returns the cached frame for key, calling load() on a miss."""
+        if key in self.frames:
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return self.frames[key]
+
+        self.misses += 1
+        frame = load()
+        size = frame_bytes(frame)
+        if size <= self.max_bytes:
+            self.frames[key] = frame
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, old = self.frames.popitem(last=False)
+                self.used_bytes -= frame_bytes(old)
+        return frame
+
+def frame_bytes(frame):
+    if isinstance(frame, np.ndarray):
+        return frame.nbytes
+    return frame.element_size() * frame.nelement()
+
+class ContiguousChunkSampler(data.Sampler):
+    """Shuffles the dataset in chunks of consecutive indices and gives every DataLoader worker
+    whole chunks, so the frame one sample loads as 'next' is the 'current' frame of the
+    following sample handled by the same worker.
+    DataLoader hands batch k to worker k % num_workers, hence the chunks of num_workers
+    workers are interleaved batch by batch.
+    """
+    def __init__(self, data_source, chunk_size, batch_size=1, num_workers=0):
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+        # whole batches per chunk, otherwise a batch would span two workers' chunks
+        self.chunk_size = max(1, chunk_size // batch_size) * batch_size
+
+    def __iter__(self):
+        n = len(self.data_source)
+        chunks = [list(range(start, min(start + self.chunk_size, n))) for start in range(0, n, self.chunk_size)]
+        random.shuffle(chunks)
+        # the short tail chunk goes last so it cannot shift the worker assignment
+        chunks.sort(key=len, reverse=True)
+
+        indices = []
+        for group in range(0, len(chunks), self.num_workers):
+            worker_chunks = chunks[group:group + self.num_workers]
+            for start in range(0, self.chunk_size, self.batch_size):
+                for chunk in worker_chunks:
+                    indices += chunk[start:start + self.batch_size]
+        return iter(indices)
+
+    def __len__(self):
+        return len(self.data_source)
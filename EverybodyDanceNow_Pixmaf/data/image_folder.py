@@ -10,6 +10,8 @@ import numpy as np
 from PIL import Image
 import os
 import os.path
+import re
+import json
 
 IMG_EXTENSIONS = [
     '.jpg', '.JPG', '.jpeg', '.JPEG',
@@ -57,6 +59,62 @@ def make_dataset_unaligned(dir, stop=100000):
     return images
 
 
+def make_dataset_manifest(dataroot, dir_names, manifest_path):
+    """sorted(make_dataset()) of several folders of dataroot, read from a manifest that is
+    built once. A folder is listed again only when the mtime of one of its directories changed.
+    Raises if the folders do not hold the same frames."""
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    changed = False
+    paths = {}
+    for name in dir_names:
+        dir = os.path.join(dataroot, name)
+        if name not in manifest or not _manifest_up_to_date(dir, manifest[name]):
+            print('listing %s' % dir)
+            manifest[name] = _list_dir(dir)
+            changed = True
+        paths[name] = [os.path.join(dir, f) for f in manifest[name]['files']]
+
+    # aligned folders hold the same frame ids in the same order
+    for name in dir_names[1:]:
+        ids, ref_ids = manifest[name]['frame_ids'], manifest[dir_names[0]]['frame_ids']
+        if ids != ref_ids:
+            mismatch = next((i for i, (a, b) in enumerate(zip(ids, ref_ids)) if a != b), min(len(ids), len(ref_ids)))
+            raise RuntimeError('%s (%d frames) and %s (%d frames) are not aligned, first mismatch at position %d' %
+                               (name, len(ids), dir_names[0], len(ref_ids), mismatch))
+
+    if changed:
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    return paths
+
+def _list_dir(dir):
+    assert os.path.isdir(dir), '%s is not a valid directory' % dir
+    files = []
+    mtimes = {}
+    for root, _, fnames in sorted(os.walk(dir)):
+        mtimes[os.path.relpath(root, dir)] = os.stat(root).st_mtime
+        files += [os.path.relpath(os.path.join(root, fname), dir) for fname in fnames if is_image_file(fname)]
+    files.sort(key=lambda f: os.path.join(dir, f))
+
+    frame_ids = []
+    for i, f in enumerate(files):
+        # frame number in the file name, the position if there is none
+        digits = re.findall(r'\d+', os.path.splitext(os.path.basename(f))[0])
+        frame_ids.append(int(digits[-1]) if digits else i)
+    sizes = [os.path.getsize(os.path.join(dir, f)) for f in files]
+    return {'mtimes': mtimes, 'files': files, 'frame_ids': frame_ids, 'sizes': sizes}
+
+def _manifest_up_to_date(dir, entry):
+    try:
+        return all(os.stat(os.path.join(dir, d)).st_mtime == mtime for d, mtime in entry['mtimes'].items())
+    except OSError:
+        return False
+
 def default_loader(path):
     return Image.open(path).convert('RGB')
 
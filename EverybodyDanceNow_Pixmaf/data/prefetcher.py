@@ -0,0 +1,53 @@
+import torch
+
+"""
+Keeps the next batch of a DataLoader in flight to the device while the current one is used.
+With pinned host memory the copies run on a side CUDA stream and overlap with compute.
+"""
+def move_batch_to_device(batch, device, host_keys=()):
+    """Copies the tensors of a (nested) batch dict to device without blocking the host."""
+    if isinstance(batch, dict):
+        return {k: v if k in host_keys else move_batch_to_device(v, device) for k, v in batch.items()}
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=True)
+    return batch
+
+def _record_stream(batch, stream):
+    # the copies were allocated on the side stream but are used on the current one
+    if isinstance(batch, dict):
+        for v in batch.values():
+            _record_stream(v, stream)
+    elif isinstance(batch, torch.Tensor) and batch.is_cuda:
+        batch.record_stream(stream)
+
+class DevicePrefetcher(object):
+    def __init__(self, loader, device, host_keys=('path', 'face_coords')):
+        self.loader = loader
+        self.device = torch.device(device)
+        # face_coords index host tensors, keep them on the host
+        self.host_keys = host_keys
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        batches = iter(self.loader)
+        next_batch = self._preload(batches, stream)
+        while next_batch is not None:
+            batch = next_batch
+            if stream is not None:
+                torch.cuda.current_stream(self.device).wait_stream(stream)
+                _record_stream(batch, torch.cuda.current_stream(self.device))
+            next_batch = self._preload(batches, stream)
+            yield batch
+
+    def _preload(self, batches, stream):
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return None
+        if stream is None:
+            return move_batch_to_device(batch, self.device, self.host_keys)
+        with torch.cuda.stream(stream):
+            return move_batch_to_device(batch, self.device, self.host_keys)
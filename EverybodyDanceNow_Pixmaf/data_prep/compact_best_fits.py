@@ -0,0 +1,50 @@
+import os
+import sys
+import argparse
+import pickle
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models.pixmaf_net.smplify.best_fits import BestFitStore
+
+"""
+Rewrites an old best_fits.pkl that also holds per-frame 'verts' and 'joints3d' so that it only
+keeps pose and betas (82 floats per frame); training rebuilds vertices and joints with SMPL.
+The original file is kept as best_fits.pkl.bak. Once training has converted the pickle to the
+best_fits/ store it is no longer read, and neither is a compacted copy. --verify N compares the
+SMPL output of N random frames with the stored joints (run from the repository root so that
+pixmaf_data/ is found).
+"""
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--dataroot', type=str, required=True, help='dataset root containing best_fits.pkl')
+parser.add_argument('--verify', type=int, default=0, help='number of random frames whose joints are checked against SMPL')
+opt = parser.parse_args()
+
+if os.path.isdir(os.path.join(opt.dataroot, 'best_fits')):
+    # BestFitStore.convert keeps pose and betas only, the store has no vertices or joints
+    sys.exit('%s exists and is what training reads, best_fits.pkl is not used' % os.path.join(opt.dataroot, 'best_fits'))
+
+file_best_fits = os.path.join(opt.dataroot, 'best_fits.pkl')
+with open(file_best_fits, 'rb') as f:
+    best_fits = pickle.load(f)
+
+if opt.verify > 0 and 'joints3d' in best_fits:
+    from models.pixmaf_net.models.smpl import SMPL
+    from models.pixmaf_net.core import path_config
+    smpl = SMPL(path_config.SMPL_MODEL_DIR, batch_size=opt.verify, create_transl=False)
+    ids = np.random.choice(len(best_fits['pose']), opt.verify, replace=False)
+    pose = torch.from_numpy(np.asarray(best_fits['pose'])[ids]).float()
+    betas = torch.from_numpy(np.asarray(best_fits['betas'])[ids]).float()
+    with torch.no_grad():
+        joints = smpl(global_orient=pose[:, :3], body_pose=pose[:, 3:], betas=betas).joints.numpy()
+    print('max joint difference over %d frames: %g' % (opt.verify, np.abs(joints - np.asarray(best_fits['joints3d'])[ids]).max()))
+
+compact = {k: v for k, v in best_fits.items() if k not in BestFitStore.DERIVED}
+with open(file_best_fits + '.tmp', 'wb') as f:
+    pickle.dump(compact, f, pickle.HIGHEST_PROTOCOL)
+os.replace(file_best_fits, file_best_fits + '.bak')
+os.replace(file_best_fits + '.tmp', file_best_fits)
+print('%s: %.1f MB -> %.1f MB' % (file_best_fits, os.path.getsize(file_best_fits + '.bak') / 2.**20,
+                                   os.path.getsize(file_best_fits) / 2.**20))
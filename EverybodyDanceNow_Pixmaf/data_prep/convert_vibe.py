@@ -0,0 +1,30 @@
+import os
+import sys
+import argparse
+import numpy as np
+import joblib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.aligned_dataset import VIBE_FIELDS
+
+"""
+Splits the VIBE result train_vibe.pkl into one .npy file per field (dataroot/train_vibe/<field>.npy).
+AlignedDataset memory-maps these files with --vibe_mmap, so DataLoader workers share the pages
+instead of each holding a full copy of the pickle.
+"""
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--dataroot', type=str, required=True, help='dataset root containing train_vibe.pkl')
+parser.add_argument('--person_id', type=int, default=1, help='track id of the person in the VIBE result')
+opt = parser.parse_args()
+
+vibe_results = joblib.load(os.path.join(opt.dataroot, 'train_vibe.pkl'))[opt.person_id]
+
+save_dir = os.path.join(opt.dataroot, 'train_vibe')
+if not os.path.exists(save_dir):
+    os.makedirs(save_dir)
+
+for key in VIBE_FIELDS:
+    value = np.ascontiguousarray(vibe_results[key])
+    np.save(os.path.join(save_dir, key + '.npy'), value)
+    print('%s: %s %s' % (key, str(value.shape), str(value.dtype)))
@@ -94,6 +94,7 @@ def makebox128(miny, maxy, minx, maxx, dimy=128, dimx=128):
 	return miny, maxy, minx, maxx
 
 
+face_boxes = []
 while n <= end:
 	print numframesmade, n
 	framesmadestr = '%06d' % numframesmade
@@ -139,6 +140,7 @@ while n <= end:
 		print(myfile)
 		F.write(str(miny) + " " + str(maxy) + " " + str(minx) + " " + str(maxx))
 		F.close()
+		face_boxes.append([miny, maxy, minx, maxx])
 
 		if saveim:
 			frame_name = "/media/hdd5tb/caroline/lingjie/train_img/frame" + string_num + ".png"
@@ -171,3 +173,5 @@ while n <= end:
 				numframesmade += 1
 		n += step
 
+# all face boxes in one array, read by AlignedDataset instead of the txt files
+np.save("/media/hdd5tb/caroline/train_facetexts128/face_boxes.npy", np.array(face_boxes, dtype=np.int16).reshape(-1, 4))
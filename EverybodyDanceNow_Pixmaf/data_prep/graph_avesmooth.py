@@ -98,6 +98,7 @@ rhand_window = []
 lhand_window = []
 
 original_queue = []
+face_boxes = []
 
 n = start
 while n <= end:
@@ -231,6 +232,7 @@ while n <= end:
 			F = open(myfile, "w")
 			F.write(str(miny) + " " + str(maxy) + " " + str(minx) + " " + str(maxx))
 			F.close()
+			face_boxes.append([miny, maxy, minx, maxx])
 
 			debug = True
 			if debug:
@@ -248,3 +250,7 @@ while n <= end:
 
 		numframesmade += 1
 	n += step
+
+if get_facetexts:
+	# all face boxes in one array, read by AlignedDataset instead of the txt files
+	np.save(savedir + '/' + phase + '_facetexts128/face_boxes.npy', np.array(face_boxes, dtype=np.int16).reshape(-1, 4))
@@ -88,6 +88,7 @@ print frames
 print('----------------- All Loaded -----------------')
 
 pose_data = []
+face_boxes = []
 
 while n <= end:
 	print n
@@ -171,6 +172,7 @@ while n <= end:
 			F = open(myfile, "w")
 			F.write(str(miny) + " " + str(maxy) + " " + str(minx) + " " + str(maxx))
 			F.close()
+			face_boxes.append([miny, maxy, minx, maxx])
 
 			# debug = True
 			if opt.debug:
@@ -181,3 +183,7 @@ while n <= end:
 
 		numframesmade += 1
 	n += step
+
+if get_factexts:
+	# all face boxes in one array, read by AlignedDataset instead of the txt files
+	np.save(savedir + '/train_facetexts128/face_boxes.npy', np.array(face_boxes, dtype=np.int16).reshape(-1, 4))
@@ -0,0 +1,29 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.image_folder import make_dataset
+
+"""
+Collects the 128x128 face boxes of an existing dataset (one 'miny maxy minx maxx' txt file per
+frame) into <phase>_facetexts128/face_boxes.npy, N x 4 int16 in the sorted file order used by
+AlignedDataset. graph_train.py, graph_avesmooth.py and get_facetexts.py write this file directly.
+"""
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--dataroot', type=str, required=True, help='dataset root containing the face box folder')
+parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
+opt = parser.parse_args()
+
+facetext_dir = os.path.join(opt.dataroot, opt.phase + '_facetexts128')
+facetext_paths = sorted(make_dataset(facetext_dir))
+
+face_boxes = np.zeros((len(facetext_paths), 4), dtype=np.int16)
+for i, path in enumerate(facetext_paths):
+    with open(path, 'r') as f:
+        face_boxes[i] = [int(coord_str) for coord_str in f.read().split()]
+
+np.save(os.path.join(facetext_dir, 'face_boxes.npy'), face_boxes)
+print('saved %d face boxes to %s' % (len(face_boxes), os.path.join(facetext_dir, 'face_boxes.npy')))
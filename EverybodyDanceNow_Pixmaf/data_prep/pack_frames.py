@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.image_folder import make_dataset
+from data.base_dataset import resize_frame
+
+"""
+Packs the label maps and real images of a dataset into raw uint8 frame packs.
+Every frame is resized exactly like the resize step of get_transform and appended to
+dataroot/<phase>_<label|img>.pack; dataroot/<phase>_<label|img>.index.npy holds the byte offset
+and the size of every frame, in the sorted file order used by AlignedDataset.
+Train with --frame_pack and the same --loadSize/--resize_or_crop/--netG flags used here.
+"""
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--dataroot', type=str, required=True, help='dataset root containing the label and image folders')
+parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
+parser.add_argument('--loadSize', type=int, default=1024, help='scale images to this size')
+parser.add_argument('--resize_or_crop', type=str, default='scale_width', help='scaling and cropping of images at load time [resize_and_crop|crop|scale_width|scale_width_and_crop]')
+parser.add_argument('--netG', type=str, default='global', help='selects model to use for netG')
+parser.add_argument('--n_downsample_global', type=int, default=4, help='number of downsampling layers in netG')
+parser.add_argument('--n_local_enhancers', type=int, default=1, help='number of local enhancers to use')
+opt = parser.parse_args()
+
+INDEX = np.dtype([('offset', np.int64), ('height', np.int32), ('width', np.int32)])
+
+def pack(name, method):
+    frame_dir = os.path.join(opt.dataroot, opt.phase + '_' + name)
+    if not os.path.isdir(frame_dir):
+        return
+    paths = sorted(make_dataset(frame_dir))
+    index = np.zeros(len(paths), dtype=INDEX)
+
+    pack_path = frame_dir + '.pack'
+    offset = 0
+    with open(pack_path + '.tmp', 'wb') as f:
+        for i, path in enumerate(paths):
+            frame = np.asarray(resize_frame(opt, Image.open(path).convert('RGB'), method), dtype=np.uint8)
+            f.write(frame.tobytes())
+            index[i] = (offset, frame.shape[0], frame.shape[1])
+            offset += frame.nbytes
+            if (i + 1) % 1000 == 0:
+                print('%s: packed %d / %d frames' % (name, i + 1, len(paths)))
+
+    np.save(frame_dir + '.index.npy', index)
+    os.replace(pack_path + '.tmp', pack_path)
+    print('saved %s (%d frames, %.1f MB)' % (pack_path, len(paths), offset / 2.**20))
+
+pack('label', Image.NEAREST)
+pack('img', Image.BICUBIC)
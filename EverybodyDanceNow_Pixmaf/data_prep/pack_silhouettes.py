@@ -0,0 +1,43 @@
+import os
+import sys
+import argparse
+import numpy as np
+import cv2
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.image_folder import make_dataset
+from models.pixmaf_net.utils.distance_transform import squared_l2_distance_transform
+
+"""
+Packs the pseudo-gt silhouettes of a dataset into one memory-mapped .npy file.
+Each record holds the bit-packed binary mask and the squared L2 distance field used by the
+silhouette loss, so training neither decodes PNGs nor recomputes the ground-truth distances.
+The records follow the sorted file order used by AlignedDataset. Train with --silhouette_cache.
+"""
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('--dataroot', type=str, required=True, help='dataset root containing the silhouette folder')
+parser.add_argument('--sil_dir', type=str, default='georges_sil_binary_384_384', help='silhouette folder inside dataroot')
+parser.add_argument('--batch_size', type=int, default=64, help='number of silhouettes transformed at once')
+opt = parser.parse_args()
+
+sil_dir = os.path.join(opt.dataroot, opt.sil_dir)
+sil_paths = sorted(make_dataset(sil_dir))
+height, width = cv2.imread(sil_paths[0], cv2.IMREAD_GRAYSCALE).shape
+
+record = np.dtype([('mask', np.uint8, (height, (width + 7) // 8)),
+                   ('dist', np.float32, (height, width))])
+out_path = sil_dir + '.npy'
+records = np.lib.format.open_memmap(out_path + '.tmp', mode='w+', dtype=record, shape=(len(sil_paths),))
+
+for start in range(0, len(sil_paths), opt.batch_size):
+    masks = np.stack([cv2.imread(path, cv2.IMREAD_GRAYSCALE) > 0 for path in sil_paths[start:start + opt.batch_size]])
+    records['mask'][start:start + len(masks)] = np.packbits(masks, axis=-1)
+    records['dist'][start:start + len(masks)] = squared_l2_distance_transform(torch.from_numpy(masks)).numpy()
+    print('packed %d / %d silhouettes' % (start + len(masks), len(sil_paths)))
+
+records.flush()
+del records
+os.replace(out_path + '.tmp', out_path)
+print('saved %s' % out_path)
@@ -9,6 +9,8 @@ import numpy as np
 import math
 import torch.nn.functional as F
 import copy
+import threading
+from collections import OrderedDict
 
 # Armin
 from .pixmaf_net.models import Pixmaf_net
@@ -135,13 +137,75 @@ class VGGLoss(nn.Module):
         self.criterion = nn.L1Loss()
         self.weights = [1.0/32, 1.0/16, 1.0/8, 1.0/4, 1.0]        
 
-    def forward(self, x, y):              
-        x_vgg, y_vgg = self.vgg(x), self.vgg(y)
+    def forward(self, x, y, y_vgg=None):
+        # y_vgg: optional precomputed features of y, e.g. from a VGGFeatureCache
+        x_vgg = self.vgg(x)
+        if y_vgg is None:
+            y_vgg = self.vgg(y)
         loss = 0
         for i in range(len(x_vgg)):
             loss += self.weights[i] * self.criterion(x_vgg[i], y_vgg[i].detach())        
         return loss
 
+class VGGFeatureCache(object):
+    """LRU cache of the Vgg19 features of real images with a byte budget per device. A key
+    identifies a transformed real image, e.g. frame index, crop position and flip, so that with a
+    fixed dataset every real image goes through VGG once.
+    The features of a 256x512 image take about 64 MB.
+
+    Every device has its own storage: with DataParallel each replica computes the features with
+    its own copy of Vgg19 and only gets features stored on its device. The replicas run in
+    threads, the storage is guarded by a lock.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # per device: OrderedDict of key -> list of features, and the bytes they take
+        self.features = {}
+        self.used_bytes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, vgg, y, keys):
+        """Vgg19 features of the batch y, only the samples missing from the cache go through VGG.
+        Input:
+            vgg: Vgg19 on the device of y
+            y: (B, 3, H, W) real images
+            keys: B hashable keys, one per sample
+        Returns:
+            list of (B, C, H', W') features, as vgg(y)
+        """
+        with self.lock:
+            features = self.features.setdefault(y.device, OrderedDict())
+            samples = [features.get(key) for key in keys]
+            missing = [i for i, f in enumerate(samples) if f is None]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            with torch.no_grad():
+                y_vgg = vgg(y[missing])
+            for j, i in enumerate(missing):
+                # copies, a view would keep the features of the whole batch alive
+                samples[i] = [f[j].clone() for f in y_vgg]
+        with self.lock:
+            for key, f in zip(keys, samples):
+                self.put(y.device, key, f)
+        return [torch.stack(level) for level in zip(*samples)]
+
+    def put(self, device, key, features):
+        cache = self.features[device]
+        if key in cache:
+            cache.move_to_end(key)
+            return
+        size = sum(f.element_size() * f.nelement() for f in features)
+        if size > self.max_bytes:
+            return
+        cache[key] = features
+        self.used_bytes[device] = self.used_bytes.get(device, 0) + size
+        while self.used_bytes[device] > self.max_bytes:
+            _, old = cache.popitem(last=False)
+            self.used_bytes[device] -= sum(f.element_size() * f.nelement() for f in old)
+
 
 ##############################################################################
 # Generator
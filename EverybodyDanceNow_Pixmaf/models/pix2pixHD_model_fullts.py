@@ -12,11 +12,11 @@ from .base_model import BaseModel
 from . import networks
 
 # Pixmaf
-from .pixmaf_net.models.networks import Pixmaf_Loss, Silhouette_model
+from .pixmaf_net.models.networks import Pixmaf_Loss, Silhouette_model, cat_smpl_outs
 from .pixmaf_net.models.motion_discriminator import MotionDiscriminator
 from .pixmaf_net.core.cfgs import cfg
 from .pixmaf_net.utils.geometry import estimate_translation
-from .pixmaf_net.smplify import SMPLify
+from .pixmaf_net.smplify import SMPLify, BestFitStore, AsyncSMPLify, smpl_from_fits
 from .pixmaf_net.core.constants import FOCAL_LENGTH
 
 class Pix2PixHDModel(BaseModel):
@@ -29,7 +29,7 @@ class Pix2PixHDModel(BaseModel):
             torch.backends.cudnn.benchmark = True
         self.isTrain = opt.isTrain
         # 记录使用SPIN方法是否有更新opt数据
-        self.countOPT = 0
+        self.countOPT = torch.zeros((), dtype=torch.long, device=cfg.DEVICE)
 
         ##### define networks        
         # Generator network
@@ -87,12 +87,21 @@ class Pix2PixHDModel(BaseModel):
         
             # Initialize SMPLify fitting module
             self.smplify = SMPLify(step_size=1e-2, batch_size=cfg.SMPLIFY.BATCH_SIZE, num_iters=cfg.SMPLIFY.NUM_ITER, \
-                                    focal_length=FOCAL_LENGTH, device=cfg.DEVICE)
+                                    focal_length=FOCAL_LENGTH, device=cfg.DEVICE, \
+                                    rel_tol=cfg.SMPLIFY.REL_TOL, patience=cfg.SMPLIFY.PATIENCE, \
+                                    check_every=cfg.SMPLIFY.CHECK_EVERY, camera_optimizer=cfg.SMPLIFY.CAMERA_OPTIMIZER)
             
             # Initialize best fits
-            file_best_fits = os.path.join(opt.dataroot, 'best_fits.pkl')
-            with open(file_best_fits,'rb') as f:
-                self.best_fits = pickle.load(f)
+            # memory-mapped dataroot/best_fits/, converted from best_fits.pkl on first use
+            dir_best_fits = os.path.join(opt.dataroot, 'best_fits')
+            self.best_fits = BestFitStore.open(dir_best_fits, device=cfg.DEVICE, on_device=cfg.SMPLIFY.BEST_FITS_ON_DEVICE)
+
+            # background SMPLify, the training step only queues its frames
+            self.refiner = None
+            if self.isTrain and opt.run_smplify and opt.async_smplify:
+                self.refiner = AsyncSMPLify(self.smplify, queue_size=cfg.SMPLIFY.ASYNC_QUEUE_SIZE,
+                                            batch_size=cfg.SMPLIFY.ASYNC_BATCH_SIZE,
+                                            max_staleness=cfg.SMPLIFY.ASYNC_MAX_STALENESS, device=cfg.DEVICE)
 
         print('---------- Networks initialized -------------')
 
@@ -120,6 +129,10 @@ class Pix2PixHDModel(BaseModel):
             self.criterionFeat = torch.nn.L1Loss()
             if not opt.no_vgg_loss:             
                 self.criterionVGG = networks.VGGLoss(self.gpu_ids)
+            # VGG features of the real images, reused when a frame comes back with the same crop and flip
+            self.vgg_cache = None
+            if not opt.no_vgg_loss and opt.vgg_cache_mb > 0:
+                self.vgg_cache = networks.VGGFeatureCache(opt.vgg_cache_mb * 2**20)
             if opt.use_l1:
                 self.criterionL1 = torch.nn.L1Loss()
 
@@ -193,33 +206,33 @@ class Pix2PixHDModel(BaseModel):
     def encode_input(self, label_map, real_image=None, next_label=None, next_image=None, zeroshere=None, \
                         other_params=None, next_other_params=None, infer=False):
 
-        input_label = label_map.data.float().cuda()
+        input_label = label_map.data.cuda(non_blocking=True).float()
         input_label = Variable(input_label, volatile=infer)
 
         # next label for training
         if next_label is not None:
-            next_label = next_label.data.float().cuda()
+            next_label = next_label.data.cuda(non_blocking=True).float()
             next_label = Variable(next_label, volatile=infer)
 
         # real images for training
         if real_image is not None:
-            real_image = Variable(real_image.data.float().cuda())
+            real_image = Variable(real_image.data.cuda(non_blocking=True).float())
 
         # real images for training
         if next_image is not None:
-            next_image = Variable(next_image.data.float().cuda())
+            next_image = Variable(next_image.data.cuda(non_blocking=True).float())
 
         if zeroshere is not None:
-            zeroshere = zeroshere.data.float().cuda()
+            zeroshere = zeroshere.data.cuda(non_blocking=True).float()
             zeroshere = Variable(zeroshere, volatile=infer)
         
         if other_params is not None:
             for k in other_params.keys():
-                other_params[k] = Variable(other_params[k].data.float().cuda())
+                other_params[k] = Variable(other_params[k].data.cuda(non_blocking=True).float())
 
         if next_other_params is not None:
             for k in next_other_params.keys():
-                next_other_params[k] = Variable(next_other_params[k].data.float().cuda())
+                next_other_params[k] = Variable(next_other_params[k].data.cuda(non_blocking=True).float())
 
         return input_label, real_image, next_label, next_image, zeroshere, other_params, next_other_params
 
@@ -249,7 +262,7 @@ class Pix2PixHDModel(BaseModel):
     
 
     def forward(self, label, next_label, image, next_image, face_coords, zeroshere, \
-                other_params, next_other_params, data_motion_mosh, infer=False):
+                other_params, next_other_params, data_motion_mosh, vgg_keys=None, infer=False):
         # Encode Inputs
         input_label, real_image, next_label, next_image, zeroshere, other_params, next_other_params = self.encode_input(label, image, \
                      next_label=next_label, next_image=next_image, zeroshere=zeroshere, \
@@ -359,14 +372,26 @@ class Pix2PixHDModel(BaseModel):
         # VGG feature matching loss
         loss_G_VGG = 0
         if not self.opt.no_vgg_loss:
-            loss_G_VGG0 = self.criterionVGG(I_0, real_image) * self.opt.lambda_feat
-            loss_G_VGG1 = self.criterionVGG(I_1, next_image) * self.opt.lambda_feat
-            loss_G_VGG = loss_G_VGG0 + loss_G_VGG1 
+            real_images = torch.cat((real_image, next_image), dim=0)
+            real_faces = torch.cat((real_face_0, real_face_1), dim=0) if self.opt.face_discrim else None
+            real_vgg = real_face_vgg = None
+            if self.vgg_cache is not None:
+                # host side keys from the dataset, no device sync
+                frame_keys = self.replica_keys(vgg_keys['frame'], len(real_image), real_image.device) + \
+                             self.replica_keys(vgg_keys['next_frame'], len(next_image), next_image.device)
+                # the replica's own Vgg19, on its device
+                real_vgg = self.vgg_cache(self.criterionVGG.vgg, real_images, frame_keys)
+                if self.opt.face_discrim:
+                    # the face box is the one of the first sample of the replica, for all its samples
+                    face_box = self.replica_keys(vgg_keys['face'], len(real_image), real_image.device)[0]
+                    real_face_vgg = self.vgg_cache(self.criterionVGG.vgg, real_faces, [k + face_box for k in frame_keys])
+
+            # both frames in one VGG pass, the mean over the two frames is half the sum of the per-frame losses
+            loss_G_VGG = 2 * self.criterionVGG(torch.cat((I_0, I_1), dim=0), real_images, real_vgg) * self.opt.lambda_feat
             if self.opt.netG == 'global': #need 2x VGG for artifacts when training local
                 loss_G_VGG *= 0.5
             if self.opt.face_discrim:
-                loss_G_VGG += 0.5 * self.criterionVGG(fake_face_0, real_face_0) * self.opt.lambda_feat
-                loss_G_VGG += 0.5 * self.criterionVGG(fake_face_1, real_face_1) * self.opt.lambda_feat
+                loss_G_VGG += self.criterionVGG(torch.cat((fake_face_0, fake_face_1), dim=0), real_faces, real_face_vgg) * self.opt.lambda_feat
 
         if self.opt.use_l1:
             loss_G_VGG += (self.criterionL1(I_1, next_image)) * self.opt.lambda_A
@@ -381,121 +406,73 @@ class Pix2PixHDModel(BaseModel):
         # gt_keypoints_2d_0 = other_params['openpose_kp_2d'] 
         # gt_keypoints_2d_1 = next_other_params['openpose_kp_2d']
 
-        img_res_0 = int(other_params['bboxes'][0][2])
-        img_res_1 = int(next_other_params['bboxes'][0][2])
-
-        frame_id_0 = int(other_params['frame_ids'].cpu().detach().numpy())
-        frame_id_1 = int(next_other_params['frame_ids'].cpu().detach().numpy())
-
-        opt_pose_0 = torch.from_numpy(self.best_fits['pose'][frame_id_0]).to(cfg.DEVICE).unsqueeze(0) # torch.Size([1, 72])
-        opt_pose_1 = torch.from_numpy(self.best_fits['pose'][frame_id_1]).to(cfg.DEVICE).unsqueeze(0)
+        # 两帧的所有样本一起拟合, 每个样本用自己的img_res
+        img_res = torch.cat([other_params['bboxes'][:, 2], next_other_params['bboxes'][:, 2]], dim=0).float().to(cfg.DEVICE)
+        camera_center = 0.5 * img_res.view(-1, 1).expand(-1, 2)
+        gt_keypoints_2d = torch.cat([gt_keypoints_2d_0, gt_keypoints_2d_1], dim=0)
+        frame_ids = torch.cat([other_params['frame_ids'], next_other_params['frame_ids']], dim=0)
 
-        opt_beta_0 = torch.from_numpy(self.best_fits['betas'][frame_id_0]).to(cfg.DEVICE).unsqueeze(0) # torch.Size([1, 10])
-        opt_beta_1 = torch.from_numpy(self.best_fits['betas'][frame_id_1]).to(cfg.DEVICE).unsqueeze(0)
+        if self.refiner is not None:
+            # 先写入后台已经完成的SMPLify结果
+            self.countOPT += self.refiner.apply(self.best_fits)
 
-        opt_joints_0 = torch.from_numpy(self.best_fits['joints3d'][frame_id_0]).to(cfg.DEVICE).unsqueeze(0) # torch.Size([1, 49, 3])
-        opt_joints_1 = torch.from_numpy(self.best_fits['joints3d'][frame_id_1]).to(cfg.DEVICE).unsqueeze(0)
-
-        opt_vertices_0 = torch.from_numpy(self.best_fits['verts'][frame_id_0]).to(cfg.DEVICE).unsqueeze(0) # torch.Size([1, 6890, 3])
-        opt_vertices_1 = torch.from_numpy(self.best_fits['verts'][frame_id_1]).to(cfg.DEVICE).unsqueeze(0)
-   
-        # 这里因为img_res不一样 因此只能一个一个算
-        opt_cam_t_0 = estimate_translation(opt_joints_0, gt_keypoints_2d_0, focal_length=FOCAL_LENGTH, img_size=img_res_0)
-        opt_cam_t_1 = estimate_translation(opt_joints_1, gt_keypoints_2d_1, focal_length=FOCAL_LENGTH, img_size=img_res_1)
+        fits = self.best_fits.gather(frame_ids)
+        opt_pose, opt_beta = fits['pose'], fits['betas'] # torch.Size([2B, 72]), torch.Size([2B, 10])
+        # vertices torch.Size([2B, 6890, 3]), joints torch.Size([2B, 49, 3])
+        (opt_vertices, opt_joints), = smpl_from_fits(self.smplify.smpl, fits)
+        opt_cam_t = estimate_translation(opt_joints, gt_keypoints_2d, focal_length=FOCAL_LENGTH, img_size=img_res)
 
         # 得到reprojection_loss
-        opt_joint_loss_0 = self.smplify.get_fitting_loss(opt_pose_0, opt_beta_0, opt_cam_t_0,
-                                                       0.5 * img_res_0 * torch.ones(cfg.SMPLIFY.BATCH_SIZE, 2, device=cfg.DEVICE),
-                                                       gt_keypoints_2d_0).mean(dim=-1)
-        
-        opt_joint_loss_1 = self.smplify.get_fitting_loss(opt_pose_1, opt_beta_1, opt_cam_t_1,
-                                                       0.5 * img_res_1 * torch.ones(cfg.SMPLIFY.BATCH_SIZE, 2, device=cfg.DEVICE),
-                                                       gt_keypoints_2d_1).mean(dim=-1)
-        
+        opt_joint_loss = self.smplify.get_fitting_loss(opt_pose, opt_beta, opt_cam_t, camera_center, gt_keypoints_2d).mean(dim=-1)
+
         if self.opt.run_smplify:
-            pred_pose_0 = S_0[-1]['theta'][:, 13:]
-            pred_pose_1 = S_1[-1]['theta'][:, 13:]
-            pred_beta_0 = S_0[-1]['pred_shape']
-            pred_beta_1 = S_1[-1]['pred_shape']
-            pred_cam_0 = S_0[-1]['theta'][:, :3]
-            pred_cam_1 = S_1[-1]['theta'][:, :3]
-            pred_cam_t_0 = torch.stack([pred_cam_0[:,1],
-                                    pred_cam_0[:,2],
-                                    2*FOCAL_LENGTH/(img_res_0 * pred_cam_0[:,0] +1e-9)],dim=-1)
-            pred_cam_t_1 = torch.stack([pred_cam_1[:,1],
-                                    pred_cam_1[:,2],
-                                    2*FOCAL_LENGTH/(img_res_1 * pred_cam_1[:,0] +1e-9)],dim=-1)
+            pred_pose = torch.cat([S_0[-1]['theta'][:, 13:], S_1[-1]['theta'][:, 13:]], dim=0)
+            pred_beta = torch.cat([S_0[-1]['pred_shape'], S_1[-1]['pred_shape']], dim=0)
+            pred_cam = torch.cat([S_0[-1]['theta'][:, :3], S_1[-1]['theta'][:, :3]], dim=0)
+            pred_cam_t = torch.stack([pred_cam[:,1],
+                                      pred_cam[:,2],
+                                      2*FOCAL_LENGTH/(img_res * pred_cam[:,0] +1e-9)],dim=-1)
             # De-normalize 2D keypoints from [-1,1] to pixel space
-            gt_keypoints_2d_orig_0 = gt_keypoints_2d_0.clone()
-            gt_keypoints_2d_orig_0[:, :, :-1] = 0.5 * img_res_0 * (gt_keypoints_2d_orig_0[:, :, :-1] + 1)
-            gt_keypoints_2d_orig_1 = gt_keypoints_2d_1.clone()
-            gt_keypoints_2d_orig_1[:, :, :-1] = 0.5 * img_res_1 * (gt_keypoints_2d_orig_1[:, :, :-1] + 1)
-
-            # ================= SMPL OUTPUT 0 =================
-            # Run SMPLify optimization starting from the network prediction
-            new_opt_vertices_0, new_opt_joints_0,\
-            new_opt_pose_0, new_opt_betas_0,\
-            new_opt_cam_t_0, new_opt_joint_loss_0 = self.smplify(
-                                        pred_pose_0.detach(), pred_beta_0.detach(),
-                                        pred_cam_t_0.detach(),
-                                        0.5 * img_res_0 * torch.ones(cfg.SMPLIFY.BATCH_SIZE, 2, device=cfg.DEVICE),
-                                        gt_keypoints_2d_orig_0)
-            new_opt_joint_loss_0 = new_opt_joint_loss_0.mean(dim=-1)
-
-            # Will update the dictionary for the examples where the new loss is less than the current one
-            update_0 = (new_opt_joint_loss_0 < opt_joint_loss_0) # tensor([False], device='cuda:0')
-
-            if update_0.detach().item():
-                opt_joint_loss_0[update_0] = new_opt_joint_loss_0[update_0]
-                opt_vertices_0[update_0, :] = new_opt_vertices_0[update_0, :]
-                opt_joints_0[update_0, :] = new_opt_joints_0[update_0, :]
-                opt_pose_0[update_0, :] = new_opt_pose_0[update_0, :]
-                opt_beta_0[update_0, :] = new_opt_betas_0[update_0, :]
-                opt_cam_t_0[update_0, :] = new_opt_cam_t_0[update_0, :]
-
-                self.best_fits['pose'][frame_id_0] = opt_pose_0.squeeze(0).cpu().detach().numpy()
-                self.best_fits['betas'][frame_id_0] = opt_beta_0.squeeze(0).cpu().detach().numpy()
-                self.best_fits['joints3d'][frame_id_0] = opt_joints_0.squeeze(0).cpu().detach().numpy()
-                self.best_fits['verts'][frame_id_0] = opt_vertices_0.squeeze(0).cpu().detach().numpy()
-
-                self.countOPT += 1
-
-            # ================= SMPL OUTPUT 1 =================
-            # Run SMPLify optimization starting from the network prediction
-            new_opt_vertices_1, new_opt_joints_1,\
-            new_opt_pose_1, new_opt_betas_1,\
-            new_opt_cam_t_1, new_opt_joint_loss_1 = self.smplify(
-                                        pred_pose_1.detach(), pred_beta_1.detach(),
-                                        pred_cam_t_1.detach(),
-                                        0.5 * img_res_1 * torch.ones(cfg.SMPLIFY.BATCH_SIZE, 2, device=cfg.DEVICE),
-                                        gt_keypoints_2d_orig_1)
-            new_opt_joint_loss_1 = new_opt_joint_loss_1.mean(dim=-1)
+            gt_keypoints_2d_orig = gt_keypoints_2d.clone()
+            gt_keypoints_2d_orig[:, :, :-1] = 0.5 * img_res.view(-1, 1, 1) * (gt_keypoints_2d_orig[:, :, :-1] + 1)
+
+        if self.opt.run_smplify and self.refiner is not None:
+            # 交给后台优化, 这一步继续使用当前的best fits
+            self.refiner.submit(frame_ids, pred_pose, pred_beta, pred_cam_t, camera_center, gt_keypoints_2d_orig, opt_joint_loss)
+        elif self.opt.run_smplify:
+            # Run SMPLify optimization starting from the network prediction, both frames in one call
+            new_opt_vertices, new_opt_joints,\
+            new_opt_pose, new_opt_betas,\
+            new_opt_cam_t, new_opt_joint_loss = self.smplify(
+                                        pred_pose.detach(), pred_beta.detach(),
+                                        pred_cam_t.detach(),
+                                        camera_center,
+                                        gt_keypoints_2d_orig)
+            new_opt_joint_loss = new_opt_joint_loss.mean(dim=-1)
 
             # Will update the dictionary for the examples where the new loss is less than the current one
-            update_1 = (new_opt_joint_loss_1 < opt_joint_loss_1) # tensor([False], device='cuda:0')
-
-            if update_1.detach().item():
-                opt_joint_loss_1[update_1] = new_opt_joint_loss_1[update_1]
-                opt_vertices_1[update_1, :] = new_opt_vertices_1[update_1, :]
-                opt_joints_1[update_1, :] = new_opt_joints_1[update_1, :]
-                opt_pose_1[update_1, :] = new_opt_pose_1[update_1, :]
-                opt_beta_1[update_1, :] = new_opt_betas_1[update_1, :]
-                opt_cam_t_1[update_1, :] = new_opt_cam_t_1[update_1, :]
-
-                self.best_fits['pose'][frame_id_1] = opt_pose_1.squeeze(0).cpu().detach().numpy()
-                self.best_fits['betas'][frame_id_1] = opt_beta_1.squeeze(0).cpu().detach().numpy()
-                self.best_fits['joints3d'][frame_id_1] = opt_joints_1.squeeze(0).cpu().detach().numpy()
-                self.best_fits['verts'][frame_id_1] = opt_vertices_1.squeeze(0).cpu().detach().numpy()
-
-                self.countOPT += 1
+            update = (new_opt_joint_loss < opt_joint_loss) # tensor([False, False], device='cuda:0')
+
+            # masked with torch.where, so no host sync is needed to decide on the update
+            opt_joint_loss = torch.where(update, new_opt_joint_loss, opt_joint_loss)
+            opt_vertices = torch.where(update.view(-1, 1, 1), new_opt_vertices, opt_vertices)
+            opt_joints = torch.where(update.view(-1, 1, 1), new_opt_joints, opt_joints)
+            opt_pose = torch.where(update.view(-1, 1), new_opt_pose, opt_pose)
+            opt_beta = torch.where(update.view(-1, 1), new_opt_betas, opt_beta)
+            opt_cam_t = torch.where(update.view(-1, 1), new_opt_cam_t, opt_cam_t)
+
+            self.best_fits.scatter(frame_ids, {'pose': opt_pose, 'betas': opt_beta}, update, opt_joint_loss)
+            self.countOPT += update.sum()
         
         # Replace extreme betas with zero betas
-        opt_beta_0[(opt_beta_0.abs() > 3).any(dim=-1)] = 0.
-        opt_beta_1[(opt_beta_1.abs() > 3).any(dim=-1)] = 0.
+        opt_beta = torch.where((opt_beta.abs() > 3).any(dim=-1, keepdim=True), torch.zeros_like(opt_beta), opt_beta)
 
         # Assert whether a fit is valid by comparing the joint loss with the threshold
-        valid_fit_0 = (opt_joint_loss_0 < cfg.SMPLIFY.THRESHOLD).to(cfg.DEVICE)
-        valid_fit_1 = (opt_joint_loss_1 < cfg.SMPLIFY.THRESHOLD).to(cfg.DEVICE)
+        valid_fit = (opt_joint_loss < cfg.SMPLIFY.THRESHOLD).to(cfg.DEVICE)
+
+        # the PixMAF outputs of both frames, the losses below run once on all 2B samples
+        if self.opt.use_pixmaf:
+            S = cat_smpl_outs(S_0, S_1)
 
         # add:
         # keypoints 2d loss, camera loss, smpl loss, vertex loss
@@ -504,14 +481,9 @@ class Pix2PixHDModel(BaseModel):
         loss_G_smpl = 0
         loss_G_verts = 0
         if self.opt.use_pixmaf:    
-            loss_G_kp2d_0, loss_G_cam_0, loss_G_smpl_0, loss_G_verts_0 = \
-                self.criterionPixmaf.get_losses(S_0, gt_keypoints_2d_0, self.opt.batchSize, img_res_0, opt_pose_0, opt_beta_0, opt_vertices_0, valid_fit_0)
-            loss_G_kp2d_1, loss_G_cam_1, loss_G_smpl_1, loss_G_verts_1 = \
-                self.criterionPixmaf.get_losses(S_1, gt_keypoints_2d_1, self.opt.batchSize, img_res_1, opt_pose_1, opt_beta_1, opt_vertices_1, valid_fit_1)
-            loss_G_kp2d = (loss_G_kp2d_0 + loss_G_kp2d_1)*0.5
-            loss_G_cam = (loss_G_cam_0 + loss_G_cam_1)*0.5
-            loss_G_smpl = (loss_G_smpl_0 + loss_G_smpl_1)*0.5
-            loss_G_verts = (loss_G_verts_0 + loss_G_verts_1)*0.5
+            # the mean over both frames, the losses on the valid fits average each frame on its own
+            loss_G_kp2d, loss_G_cam, loss_G_smpl, loss_G_verts = \
+                self.criterionPixmaf.get_losses(S, gt_keypoints_2d, 2 * self.opt.batchSize, img_res, opt_pose, opt_beta, opt_vertices, valid_fit, n_frames=2)
 
         # 加入silhouette loss
         loss_G_silhouette = 0
@@ -520,15 +492,16 @@ class Pix2PixHDModel(BaseModel):
             silhouette_loss0 = 0
             silhouette_loss1 = 0
             # for smpl_out_0 in S_0:
-            #     silhouette_loss0 += self.criterionPixmaf.get_silhouette_loss(other_params['silhouette'].squeeze(0),smpl_out_0)
+            #     silhouette_loss0 += self.criterionPixmaf.get_silhouette_loss(other_params['silhouette'],smpl_out_0)
             # for smpl_out_1 in S_1:
-            #     silhouette_loss1 += self.criterionPixmaf.get_silhouette_loss(next_other_params['silhouette'].squeeze(0),smpl_out_1)
+            #     silhouette_loss1 += self.criterionPixmaf.get_silhouette_loss(next_other_params['silhouette'],smpl_out_1)
             
-            smpl_out_0 = S_0[-1]
-            silhouette_loss0 = self.criterionPixmaf.get_silhouette_loss(other_params['silhouette'].squeeze(0),smpl_out_0)
-            smpl_out_1 = S_1[-1]
-            silhouette_loss1 = self.criterionPixmaf.get_silhouette_loss(next_other_params['silhouette'].squeeze(0),smpl_out_1)
-            loss_G_silhouette = (silhouette_loss0+silhouette_loss1)*0.5     
+            # both frames in one render, the mean over both frames
+            silhouette = torch.cat((other_params['silhouette'], next_other_params['silhouette']), dim=0)
+            silhouette_dist = None
+            if other_params.get('silhouette_dist') is not None:
+                silhouette_dist = torch.cat((other_params['silhouette_dist'], next_other_params['silhouette_dist']), dim=0)
+            loss_G_silhouette = self.criterionPixmaf.get_silhouette_loss(silhouette, S[-1], gt_distance=silhouette_dist)
         
         # 加入beta一致loss
         loss_G_shapeCoherence = 0
@@ -539,7 +512,8 @@ class Pix2PixHDModel(BaseModel):
         loss_G_motion = 0
         loss_D_motion = 0
         if self.opt.use_pixmaf:  
-            pred_motion = torch.cat((S_0[-1]['theta'],S_1[-1]['theta']),dim=0).unsqueeze(0)
+            # one sequence of two frames per sample, [B,2,85]
+            pred_motion = torch.stack((S_0[-1]['theta'],S_1[-1]['theta']),dim=1)
             loss_G_motion, loss_D_motion = self.criterionPixmaf.get_motion_disc_loss(pred_motion, self.netDmotion, data_motion_mosh)
 
         # Only return the fake_B image if necessary to save BW
@@ -550,6 +524,16 @@ class Pix2PixHDModel(BaseModel):
                         None if not infer else [torch.cat((I_0, I_1), dim=3), fake_face, face_residual, initial_I_0, \
                                                 [S_0[-1], S_1[-1]] ] ]
 
+    def replica_keys(self, keys, batch_size, device):
+        """The keys (a list, one per sample) of the samples of this DataParallel replica.
+        DataParallel splits tensors in chunks of ceil(B / #gpus) but gives lists whole to every
+        replica."""
+        if len(keys) == batch_size:
+            return list(keys)
+        chunk = -(-len(keys) // len(self.gpu_ids))
+        start = self.gpu_ids.index(device.index) * chunk
+        return list(keys[start:start + batch_size])
+
     def inference(self, label, prevouts, face_coords):
 
         # Encode Inputs        
@@ -55,6 +55,11 @@ cfg.PixMAF.N_ITER = 4
 cfg.PixMAF.MLP_DIM = [[512, 256, 128, 5],[256, 128, 64, 5],[128, 64, 32, 5],[64, 32, 16, 5]]
 cfg.PixMAF.BACKBONE = 'Pix2pixHD'
 cfg.PixMAF.USE_SILHOUETTE = True
+# activation checkpointing, recomputes activations in the backward pass to save memory
+# number of checkpointed segments of the ResnetBlock trunk of Down_Sampling, 0 disables it
+cfg.PixMAF.CHECKPOINT_TRUNK_SEGMENTS = 0
+# indices (0-3) of the deconv blocks of PixMAF.forward that are checkpointed
+cfg.PixMAF.CHECKPOINT_DECONV = []
 
 cfg.LOSS = CN(new_allowed=True)
 cfg.LOSS.KP_2D_W = 300.
@@ -69,6 +74,19 @@ cfg.SMPLIFY = CN(new_allowed=True)
 cfg.SMPLIFY.BATCH_SIZE = 1
 cfg.SMPLIFY.NUM_ITER = 100
 cfg.SMPLIFY.THRESHOLD = 2.
+# early stopping: relative loss change below REL_TOL for PATIENCE iterations (0 runs all NUM_ITER),
+# converged samples leave the batch every CHECK_EVERY iterations
+cfg.SMPLIFY.REL_TOL = 1e-4
+cfg.SMPLIFY.PATIENCE = 5
+cfg.SMPLIFY.CHECK_EVERY = 10
+# 'adam' or 'lbfgs' for the camera stage
+cfg.SMPLIFY.CAMERA_OPTIMIZER = 'adam'
+# keep the best fits table on cfg.DEVICE, otherwise in pinned host memory
+cfg.SMPLIFY.BEST_FITS_ON_DEVICE = True
+# --async_smplify: pending training steps, frames fitted together, steps after which a job is discarded
+cfg.SMPLIFY.ASYNC_QUEUE_SIZE = 8
+cfg.SMPLIFY.ASYNC_BATCH_SIZE = 64
+cfg.SMPLIFY.ASYNC_MAX_STALENESS = 50
 
 def get_cfg_defaults():
     """Get a yacs CfgNode object with default values for my_project."""
@@ -7,11 +7,15 @@ import torch.nn as nn
 import numpy as np
 import torch.nn.functional as F
 import functools
+import inspect
+from torch.utils import checkpoint as torch_checkpoint
 import neural_renderer as nr
-from .smpl import SMPL, SMPL_MODEL_DIR, get_smpl_faces
+from .smpl import SMPL, SMPL_MODEL_DIR, get_smpl, get_smpl_faces
 from ..utils.geometry import perspective_projection,batch_rodrigues
+from ..utils.distance_transform import silhouette_distance_loss
 from ..core.cfgs import cfg
 from ..core import path_config
+from ..utils.amp import float32
 from .pred_cam_to_orig_cam import convert_crop_cam_to_orig_img, Renderer
 
 ###############################################################################
@@ -39,19 +43,44 @@ def move_dict_to_device(dict, device, tensor2float=False):
     for k,v in dict.items():
         if isinstance(v, torch.Tensor):
             if tensor2float:
-                dict[k] = v.float().to(device)
+                dict[k] = v.float().to(device, non_blocking=True)
             else:
-                dict[k] = v.to(device)
+                dict[k] = v.to(device, non_blocking=True)
+
+def cat_smpl_outs(*smpl_outs):
+    """Concatenates the PixMAF outputs (lists of per-iteration dicts) of several batches along
+    the batch dimension, so that the losses run once for all of them."""
+    return [{k: torch.cat([out[k] for out in outs], dim=0) for k in outs[0]}
+            for outs in zip(*smpl_outs)]
 
 ###############################################################################
 # Downsampling and Upsampling
 ###############################################################################
 
+# non-reentrant checkpointing where available: it also works when the input needs no gradient
+_checkpoint_kwargs = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(torch_checkpoint.checkpoint_sequential).parameters else {}
+
+def checkpoint(function, input):
+    """function(input) without keeping its activations, they are recomputed in the backward pass."""
+    if not torch.is_grad_enabled():
+        return function(input)
+    return torch_checkpoint.checkpoint(function, input, **_checkpoint_kwargs)
+
+def checkpoint_sequential(model, segments, input):
+    """model(input) for a nn.Sequential, keeping only the activations between segments."""
+    if not torch.is_grad_enabled():
+        return model(input)
+    return torch_checkpoint.checkpoint_sequential(model, segments, input, **_checkpoint_kwargs)
+
 class Down_Sampling(nn.Module):
     def __init__(self, input_nc=6, ngf=64, n_downsampling=4, n_blocks=9, 
-                                    norm_layer=get_norm_layer(norm_type='instance'), padding_type='reflect'):
+                                    norm_layer=get_norm_layer(norm_type='instance'), padding_type='reflect',
+                                    checkpoint_segments=0):
+        """checkpoint_segments: if > 0, the resnet blocks run checkpointed in this many segments"""
         assert(n_blocks >= 0)
         super(Down_Sampling, self).__init__()        
+        self.n_blocks = n_blocks
+        self.checkpoint_segments = min(checkpoint_segments, n_blocks)
 
         #self.avgpool = nn.AvgPool2d((8,16), stride=(8,16))
         activation = nn.ReLU(True)      
@@ -70,7 +99,13 @@ class Down_Sampling(nn.Module):
         self.model = nn.Sequential(*model)
             
     def forward(self, input):
-        s_feat = self.model(input)    
+        if self.checkpoint_segments > 0:
+            # the resnet blocks are the last n_blocks layers
+            trunk_start = len(self.model) - self.n_blocks
+            s_feat = self.model[:trunk_start](input)
+            s_feat = checkpoint_sequential(self.model[trunk_start:], self.checkpoint_segments, s_feat)
+        else:
+            s_feat = self.model(input)    
         #g_feat = self.avgpool(s_feat)
 
         return s_feat      
@@ -186,13 +221,17 @@ class Pixmaf_Loss():
 
     def get_losses(self, smpl_outs, gt_keypoints_2d, batch_size, img_res, \
                         opt_pose, opt_betas, opt_vertices, valid_fit, \
-                        focal_length = 5000. ,device = 'cuda'):
+                        focal_length = 5000. ,device = 'cuda', n_frames=1):
+        # n_frames: the batch stacks n_frames frames of batch_size / n_frames samples, the pose, betas
+        # and vertex losses are the mean of the per-frame losses
         # loss dict     
         kp2d_loss_dict = {}
         cam_loss_dict = {}
         smpl_loss_dict = {}
         verts_loss_dict = {}
-        smpl = SMPL(SMPL_MODEL_DIR, batch_size=batch_size, create_transl=False).to(device)
+        smpl = get_smpl(device)
+        # img_res: scalar or (B,) bounding box sizes
+        img_res = torch.as_tensor(img_res, dtype=torch.float32, device=device).view(-1)
         len_loop = len(smpl_outs) # 5
         for l_i in range(len_loop):
             # Ignore first intial value
@@ -220,7 +259,7 @@ class Pixmaf_Loss():
                                                     focal_length=focal_length,
                                                     camera_center=camera_center)
             # Normalize keypoints to [-1,1]
-            pred_keypoints_2d = pred_keypoints_2d / (img_res / 2.)   # 49 joints
+            pred_keypoints_2d = pred_keypoints_2d / (img_res.view(-1, 1, 1) / 2.)   # 49 joints
 
             # KP2D loss
             loss_keypoints = self.keypoint_loss_49(pred_keypoints_2d, gt_keypoints_2d) * cfg.LOSS.KP_2D_W
@@ -232,14 +271,14 @@ class Pixmaf_Loss():
             cam_loss_dict['loss_cam_{}'.format(l_i)] = loss_cam
 
             # SMPL loss
-            loss_regr_pose, loss_regr_betas = self.smpl_losses(pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit)
+            loss_regr_pose, loss_regr_betas = self.smpl_losses(pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit, n_frames)
             loss_regr_pose *= cfg.LOSS.POSE_W
             loss_regr_betas *= cfg.LOSS.SHAPE_W
             smpl_loss_dict['loss_regr_pose_{}'.format(l_i)] = loss_regr_pose
             smpl_loss_dict['loss_regr_betas_{}'.format(l_i)] = loss_regr_betas
 
             # Per-vertex loss for the shape
-            loss_shape = self.shape_loss(pred_vertices, opt_vertices, valid_fit) * cfg.LOSS.VERT_W
+            loss_shape = self.shape_loss(pred_vertices, opt_vertices, valid_fit, n_frames) * cfg.LOSS.VERT_W
             verts_loss_dict['loss_shape_{}'.format(l_i)] = loss_shape
 
         kp2d_loss = torch.stack(list(kp2d_loss_dict.values())).sum()
@@ -249,7 +288,11 @@ class Pixmaf_Loss():
 
         return kp2d_loss, cam_loss, smpl_loss, verts_loss 
 
-    def smpl_losses(self, pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit):
+    def smpl_losses(self, pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit, n_frames=1):
+        if n_frames > 1:
+            losses = [self.smpl_losses(*frame) for frame in
+                      zip(*[t.chunk(n_frames) for t in (pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit)])]
+            return sum(l[0] for l in losses) / n_frames, sum(l[1] for l in losses) / n_frames
         pred_rotmat_valid = pred_rotmat[valid_fit == 1]
         opt_rotmat_valid = batch_rodrigues(opt_pose.view(-1,3)).view(-1, 24, 3, 3)[valid_fit == 1]
         pred_betas_valid = pred_betas[valid_fit == 1]
@@ -262,8 +305,11 @@ class Pixmaf_Loss():
             loss_regr_betas = torch.FloatTensor(1).fill_(0.).to(self.device)
         return loss_regr_pose, loss_regr_betas
 
-    def shape_loss(self, pred_vertices, opt_vertices, valid_fit):
+    def shape_loss(self, pred_vertices, opt_vertices, valid_fit, n_frames=1):
         """Compute per-vertex loss on the shape for the examples that SMPL annotations are available."""
+        if n_frames > 1:
+            return sum(self.shape_loss(*frame) for frame in
+                       zip(pred_vertices.chunk(n_frames), opt_vertices.chunk(n_frames), valid_fit.chunk(n_frames))) / n_frames
         pred_vertices_with_shape = pred_vertices[valid_fit]
         opt_vertices_with_shape = opt_vertices[valid_fit]
         if len(opt_vertices_with_shape) > 0:
@@ -273,7 +319,7 @@ class Pixmaf_Loss():
 
     # for motion_discriminator
     def get_motion_disc_loss(self, pred_motion, motion_discriminator, data_motion_mosh):
-        # pred_motion [1,2,85] [batchsize,sequence_len,theta]
+        # pred_motion [B,2,85] [batchsize,sequence_len,theta]
         end_idx = 75
         start_idx = 6
         g_motion_disc_loss = self.enc_loss(motion_discriminator(pred_motion[:, :, start_idx:end_idx]))
@@ -298,73 +344,35 @@ class Pixmaf_Loss():
         return loss_coh_betas
 
     # for silhouette 考虑crop_res = 384
-    def get_silhouette_loss(self, crop_img, smpl_out, crop_res=384, batch_size=1, device='cuda'):
-        smpl = SMPL(SMPL_MODEL_DIR, batch_size=batch_size, create_transl=False).to(device)
+    def get_silhouette_loss(self, crop_img, smpl_out, crop_res=384, gt_distance=None, device='cuda'):
+        # crop_img: (B, H, W) or (H, W) pseudo-gt silhouette
+        # gt_distance: optional precomputed squared_l2_distance_transform of crop_img
         pred_rotmat = smpl_out['rotmat']
         pred_betas = smpl_out['theta'][:, 3:13]
         pred_camera =  smpl_out['theta'][:, :3]
+        batch_size = pred_rotmat.shape[0]
 
+        smpl = get_smpl(device)
         pred_output = smpl(betas=pred_betas, body_pose=pred_rotmat[:,1:],
                             global_orient=pred_rotmat[:,0].unsqueeze(1), pose2rot=False)
         pred_vertices = pred_output.vertices
 
         # for silhouette loss
-        silhouette_model = Silhouette_model(crop_res).to(self.device)
-        silhouettes_img = silhouette_model(pred_vertices,pred_camera).squeeze(0)
+        silhouette_model = get_silhouette_model(crop_res, self.device)
+        silhouettes_img = silhouette_model(pred_vertices,pred_camera)
+
+        if crop_img.dim() == 2:
+            crop_img = crop_img.unsqueeze(0)
+        if gt_distance is not None and gt_distance.dim() == 2:
+            gt_distance = gt_distance.unsqueeze(0)
 
         # crop_img: 1
         # silhouettes_img: 2
-        crop_img_index = (crop_img>0).nonzero(as_tuple=False)
-        silhouettes_img_index = (silhouettes_img>0).nonzero(as_tuple=False)
-        diff_index = (((crop_img>0) == (silhouettes_img>0))==0).nonzero(as_tuple=False)
-
-        l1 = 0
-        l2_squared = 0
-        
-        for i in range(diff_index.shape[0]):
-            a = crop_img[diff_index[i][0],diff_index[i][1]]
-            b = silhouettes_img[diff_index[i][0],diff_index[i][1]]
-
-            # 点在1上
-            if a!=0 and b==0:
-                try:    
-                    l1 += self._caldist_l1(diff_index[i].float(),silhouettes_img_index.float())
-                except:
-                    # print('------------------SIL L1 ERROR------------------')
-                    # print('a: ',a)
-                    # print('b: ',b)
-                    # print('diff_index[i]: ',diff_index[i].float())
-                    # print('silhouettes_img_index: ',silhouettes_img_index.shape)
-                    # print('-----------------------END-----------------------')
-                    break
-        
-            # 点在2上
-            elif a==0 and b!= 0:
-                try:
-                    l2_squared += self._caldist_squared_l2(diff_index[i].float(),crop_img_index.float())
-                except:
-                    # print('------------------SIL L2 ERROR------------------')
-                    # print('a: ',a)
-                    # print('b: ',b)
-                    # print('diff_index[i]: ',diff_index[i].float())
-                    # print('crop_img_index: ',crop_img_index.shape)
-                    # print('-----------------------END-----------------------')
-                    break
-
-            else:
-                print('Error')
-
-        silhouette_loss = (l1 + l2_squared) * cfg.LOSS.SILHOUETTES_W
+        # 点在1上: L1 distance to 2, 点在2上: squared L2 distance to 1
+        silhouette_loss = silhouette_distance_loss(crop_img, silhouettes_img, gt_distance=gt_distance).mean()
+        silhouette_loss = silhouette_loss * cfg.LOSS.SILHOUETTES_W
         return silhouette_loss
 
-    def _caldist_squared_l2(self,pt,pts):
-        d = torch.min(torch.sum((pts - pt)*(pts - pt), dim=1))
-        return d
-
-    def _caldist_l1(self,pt,pts):
-        d = torch.min(torch.sum(torch.abs(pts - pt), dim=1))
-        return d
-
 
 class Silhouette_model(nn.Module):
     def __init__(self, crop_res=384):
@@ -377,7 +385,7 @@ class Silhouette_model(nn.Module):
         self.register_buffer('faces', faces)
 
         textures = np.load(path_config.VERTEX_TEXTURE_FILE)
-        self.textures = torch.from_numpy(textures).cuda().float()
+        self.register_buffer('textures', torch.from_numpy(textures).float())
 
         # setup renderer
         self.focal_length = 5000
@@ -390,6 +398,8 @@ class Silhouette_model(nn.Module):
                                            anti_aliasing=True)
         self.renderer = renderer
 
+    # the neural_renderer kernels only take float32
+    @float32
     def forward(self, vertices, camera):
         cam_t = torch.stack([camera[:,1], camera[:,2], 2*self.focal_length/(self.render_res * camera[:,0] +1e-9)],dim=-1)
         batch_size = vertices.shape[0] 
@@ -402,12 +412,23 @@ class Silhouette_model(nn.Module):
         K = K[None, :, :].expand(batch_size, -1, -1)
         R = torch.eye(3, device=vertices.device)[None, :, :].expand(batch_size, -1, -1)
         t = cam_t.unsqueeze(1)
-        self.faces = self.faces.expand(batch_size, -1, -1)
+        # a view per call, the buffer itself keeps batch size 1
+        faces = self.faces.expand(batch_size, -1, -1)
 
         # render_silhouettes
-        silhouettes_img =  self.renderer(vertices, self.faces, textures=self.textures, mode='silhouettes',K=K, R=R, t=t)  
+        silhouettes_img =  self.renderer(vertices, faces, textures=self.textures, mode='silhouettes',K=K, R=R, t=t)  
         return silhouettes_img
 
+# silhouette renderers shared by the losses, keyed by (crop_res, device, dtype)
+_silhouette_models = {}
+
+def get_silhouette_model(crop_res=384, device='cuda', dtype=torch.float32):
+    """Shared Silhouette_model, the textures and the renderer are set up once per key."""
+    key = (crop_res, str(torch.device(device)), dtype)
+    if key not in _silhouette_models:
+        _silhouette_models[key] = Silhouette_model(crop_res).to(device=device, dtype=dtype)
+    return _silhouette_models[key]
+
 
 def batch_encoder_disc_l2_loss(disc_value):
     '''
@@ -431,13 +452,20 @@ def batch_adv_disc_l2_loss(real_disc_value, fake_disc_value):
 # Render
 ###############################################################################
 
+_renderers = {}
+
+def get_renderer(resolution):
+    if resolution not in _renderers:
+        _renderers[resolution] = Renderer(resolution=resolution, orig_img=True, wireframe=False)
+    return _renderers[resolution]
+
 def render_smpl(smpl_output, bboxes, imgs, orig_width=512, orig_height=256):
     '''
     bboxes (2,4)
     pred_camera (2,3)
     pred_vertices (2,6890,3)
     '''
-    bboxes = bboxes.numpy()
+    bboxes = bboxes.cpu().numpy()
     # img = img.numpy().transpose(0,2,3,1)
     pred_camera = torch.cat((smpl_output[0]['theta'][:, :3],smpl_output[1]['theta'][:, :3]),dim=0).cpu().detach().numpy()
     pred_vertices = torch.cat((smpl_output[0]['verts'],smpl_output[1]['verts']),dim=0).cpu().detach().numpy()
@@ -449,8 +477,8 @@ def render_smpl(smpl_output, bboxes, imgs, orig_width=512, orig_height=256):
             img_height=orig_height
         )
 
-    # render
-    renderer = Renderer(resolution=(orig_width, orig_height), orig_img=True, wireframe=False)
+    # render, the offscreen renderer is created once per resolution
+    renderer = get_renderer((orig_width, orig_height))
     mesh_filename = None
     img_render_0 = renderer.render(
                     imgs[0],
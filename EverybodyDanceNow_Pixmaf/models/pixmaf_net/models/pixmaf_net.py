@@ -1,13 +1,14 @@
 import torch
 import torch.nn as nn
 import numpy as np
+from math import floor
 from torch.nn import functional as F
 
 from ..core.cfgs import cfg
 from ..utils.geometry import rot6d_to_rotmat, projection, rotation_matrix_to_angle_axis
 from .maf_extractor import MAF_Extractor
-from .smpl import SMPL, SMPL_MODEL_DIR, SMPL_MEAN_PARAMS, H36M_TO_J14
-from .networks import Down_Sampling, Up_Sampling
+from .smpl import get_smpl, SMPL_MEAN_PARAMS, H36M_TO_J14
+from .networks import Down_Sampling, Up_Sampling, checkpoint
 
 import logging
 logger = logging.getLogger(__name__)
@@ -30,11 +31,8 @@ class Regressor(nn.Module):
         nn.init.xavier_uniform_(self.decshape.weight, gain=0.01)
         nn.init.xavier_uniform_(self.deccam.weight, gain=0.01)
 
-        self.smpl = SMPL(
-            SMPL_MODEL_DIR,
-            batch_size=2,
-            create_transl=False
-        )
+        # the SMPL model is not a submodule: the shared one of get_smpl works for any batch size
+        # and is not stored in the checkpoints
 
         mean_params = np.load(smpl_mean_params)
         init_pose = torch.from_numpy(mean_params['pose'][:]).unsqueeze(0)
@@ -55,6 +53,7 @@ class Regressor(nn.Module):
         self.register_buffer('init_cam', init_cam)
 
     def forward(self, x, res, init_pose=None, init_shape=None, init_cam=None, n_iter=1, J_regressor=None):
+        """res: scalar or (B,) bounding box sizes"""
         batch_size = x.shape[0]
 
         if init_pose is None:
@@ -79,7 +78,7 @@ class Regressor(nn.Module):
 
         pred_rotmat = rot6d_to_rotmat(pred_pose).view(batch_size, 24, 3, 3)
 
-        pred_output = self.smpl(
+        pred_output = get_smpl(x.device)(
             betas=pred_shape,
             body_pose=pred_rotmat[:, 1:],
             global_orient=pred_rotmat[:, 0].unsqueeze(1),
@@ -127,7 +126,7 @@ class Regressor(nn.Module):
 
         pred_rotmat = rot6d_to_rotmat(pred_pose.contiguous()).view(batch_size, 24, 3, 3)
 
-        pred_output = self.smpl(
+        pred_output = get_smpl(x.device)(
             betas=pred_shape,
             body_pose=pred_rotmat[:, 1:],
             global_orient=pred_rotmat[:, 0].unsqueeze(1),
@@ -167,7 +166,8 @@ class PixMAF(nn.Module):
 
         # 特征提取
         # EDN下采样backbone [-1, 1024, 16, 32]
-        self.feature_extractor = Down_Sampling(input_nc=6, ngf=64, n_downsampling=4, n_blocks=9)
+        self.feature_extractor = Down_Sampling(input_nc=6, ngf=64, n_downsampling=4, n_blocks=9,
+                                               checkpoint_segments=cfg.PixMAF.CHECKPOINT_TRUNK_SEGMENTS)
 
         # deconv layers
         self.deconv_layers = self._make_deconv_layer()
@@ -205,76 +205,41 @@ class PixMAF(nn.Module):
     def _make_deconv_layer(self):
         return Up_Sampling()
 
-    def _crop_feature(self, feature, bbox, step, stage = 'global', device='cuda'):
-        '''
-        h = 512
-        w = 1024
-        x1 = bbox[0]-bbox[2]/2
-        y1 = bbox[1]-bbox[2]/2
-        x2 = bbox[0]+bbox[2]/2
-        y2 = bbox[1]+bbox[2]/2
-
-        a = (x2-x1)/w
-        b = (y2-y1)/h
-        tx = -1+(x1+x2)/w
-        ty = -1+(y1+y2)/h
-
-        theta = torch.tensor([
-            [a,0,tx],
-            [0,b,ty]
-        ], dtype=torch.float).to(device)
-
-        # print(feature.shape)
-
-        size = torch.Size((1, feature.shape[1], int(bbox[2]/h*feature.shape[2]), int(bbox[2]/h*feature.shape[2])))
-        grid = F.affine_grid(theta.unsqueeze(0), size)
-        output = F.grid_sample(feature, grid, mode='bilinear', padding_mode='zeros')
-        # print(output.shape)
-        '''
-
-        # 修改成不需要grid_sample的过程
-        # bbox (4,)
-        from math import floor  
-
-        x1 = bbox[0]-bbox[2]/2
-        y1 = bbox[1]-bbox[2]/2
-        x2 = bbox[0]+bbox[2]/2
-        y2 = bbox[1]+bbox[2]/2
-
-        if stage == 'global':
-            h = 256
-            w = 512
-            h_f = 32
-            w_f = 64
-
-        base_side = floor(bbox[2]/h*h_f)
-        base_x1 = floor(x1/w*w_f)
-        base_y1 = floor(y1/h*h_f)
-        base_x2 = base_x1 + base_side
-        base_y2 = base_y1 + base_side
-
-        f_dim = feature.shape[1]
-        f_h = feature.shape[2]
-        f_w = feature.shape[3]
-        
-        # base: [512,32,64]
-        k = 2**step        
-        lu_x = base_x1 * k
-        lu_y = base_y1 * k
-        rb_x = base_x2 * k 
-        rb_y = base_y2 * k 
-        p = max(-lu_x, -lu_y, rb_x-f_w, rb_y-f_h, 0)
-        feature = F.pad(feature,(p,p,p,p),'constant',0)
-        output = feature[:,:,lu_y+p:rb_y+p,lu_x+p:rb_x+p]
-
-        # print(output.shape)
-        return output
+    def _crop_feature(self, feature, bboxes, img_size, step, max_side):
+        """Crops the bounding box of every sample out of the feature map, all samples in one
+        grid_sample (bilinear, zero outside the map).
+        The crop size follows the old integer slice: floor(side / h * h_f) * 2**step, with h_f the
+        feature height of step 0. A batch has one size, the one of its largest box, so smaller boxes
+        are sampled a bit finer than the slice did; a batch of one box gets the old size.
+        Input:
+            feature: (B, C, H, W) feature map of refinement step `step` of an image of size img_size
+            bboxes: (B, 4) boxes (center x, center y, side, _) in image pixels
+            img_size: (h, w) of the image
+            max_side: python float, the largest box side of the batch
+        Returns:
+            (B, C, S, S) crops
+        """
+        h, w = img_size
+        bboxes = bboxes.to(feature.device, feature.dtype)
+        theta = feature.new_zeros(len(bboxes), 2, 3)
+        theta[:, 0, 0] = bboxes[:, 2] / w
+        theta[:, 0, 2] = 2 * bboxes[:, 0] / w - 1
+        theta[:, 1, 1] = bboxes[:, 2] / h
+        theta[:, 1, 2] = 2 * bboxes[:, 1] / h - 1
+
+        k = 2 ** step
+        side = max(1, floor(max_side / h * (feature.shape[2] // k))) * k
+        grid = F.affine_grid(theta, (len(bboxes), feature.shape[1], side, side), align_corners=False)
+        return F.grid_sample(feature, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
 
     def forward(self, x, init_params, J_regressor=None):
 
         batch_size = x.shape[0]
-        bbox = init_params['bboxes'][0]
-        res = int(bbox[2])
+        # every sample has its own bounding box, res (B,) are their sizes
+        bboxes = init_params['bboxes']
+        res = bboxes[:, 2].to(x.device, x.dtype)
+        # the crop size is a python int, one host read per forward like the old int(bbox[2])
+        max_side = float(bboxes[:, 2].max())
 
         # spatial features and global features
         # [-1, 1024, 16, 32]
@@ -299,7 +264,10 @@ class PixMAF(nn.Module):
         # parameter predictions
         for rf_i in range(cfg.PixMAF.N_ITER): # 0, 1, 2, 3
 
-            s_feat_i = deconv_blocks[rf_i](s_feat)
+            if rf_i in cfg.PixMAF.CHECKPOINT_DECONV:
+                s_feat_i = checkpoint(deconv_blocks[rf_i], s_feat)
+            else:
+                s_feat_i = deconv_blocks[rf_i](s_feat)
             # print('s_feat_i',rf_i,':',s_feat_i.shape)
             s_feat = s_feat_i   
             # vis_feat_list.append(s_feat_i.detach())
@@ -314,7 +282,7 @@ class PixMAF(nn.Module):
                 pred_pose = pred_pose.detach()
 
                 # 对s_feat_i进行修剪 TODO 只是一种尝试
-                s_feat_i = self._crop_feature(s_feat_i, bbox, rf_i)
+                s_feat_i = self._crop_feature(s_feat_i, bboxes, x.shape[2:], rf_i, max_side)
 
                 self.maf_extractor[rf_i].im_feat = s_feat_i
                 self.maf_extractor[rf_i].cam = pred_cam
@@ -4,10 +4,11 @@ import torch
 import numpy as np
 from smplx import SMPL as _SMPL
 from smplx.body_models import ModelOutput
-from smplx.lbs import vertices2joints
+from smplx.lbs import vertices2joints, blend_shapes, batch_rodrigues, batch_rigid_transform
 from collections import namedtuple
 
 from ..core import path_config, constants
+from ..utils.amp import float32
 
 SMPL_MEAN_PARAMS = 'pixmaf_data/smpl_mean_params.npz'
 SMPL_MODEL_DIR = 'pixmaf_data/smpl'
@@ -29,7 +30,27 @@ class SMPL(_SMPL):
         self.ModelOutput = namedtuple('ModelOutput_', ModelOutput._fields + ('smpl_joints', 'joints_J19',))
         self.ModelOutput.__new__.__defaults__ = (None,) * len(self.ModelOutput._fields)
 
-    def forward(self, *args, **kwargs):
+        # vertices the 49 joints depend on: the vertex joints of smplx and the support of J_regressor_extra
+        selector_ids = self.vertex_joint_selector.extra_joints_idxs
+        extra_ids = torch.nonzero(self.J_regressor_extra.abs().sum(dim=0) > 0).view(-1)
+        joint_vertex_ids, inverse = torch.unique(torch.cat([selector_ids.long(), extra_ids]), return_inverse=True)
+        self.register_buffer('joint_vertex_ids', joint_vertex_ids)
+        # positions of the selected vertices within joint_vertex_ids
+        self.register_buffer('selector_pos', inverse[:len(selector_ids)])
+        self.register_buffer('J_regressor_extra_sub', self.J_regressor_extra[:, joint_vertex_ids])
+        num_pose_basis = self.posedirs.shape[0]
+        self.register_buffer('posedirs_sub', self.posedirs.view(num_pose_basis, -1, 3)[:, joint_vertex_ids].reshape(num_pose_basis, -1))
+        self.register_buffer('lbs_weights_sub', self.lbs_weights[joint_vertex_ids])
+        self.register_buffer('v_template_sub', self.v_template[joint_vertex_ids])
+        self.register_buffer('shapedirs_sub', self.shapedirs[joint_vertex_ids])
+        # J_regressor premultiplied into the template and the shape basis, the rest joints need no mesh
+        self.register_buffer('J_template', vertices2joints(self.J_regressor, self.v_template.unsqueeze(0))[0])
+        self.register_buffer('J_shapedirs', torch.einsum('jv,vkl->jkl', self.J_regressor, self.shapedirs))
+
+    @float32
+    def forward(self, *args, joints_only=False, **kwargs):
+        if joints_only:
+            return self.forward_joints(*args, **kwargs)
         kwargs['get_skin'] = True
         smpl_output = super().forward(*args, **kwargs)
         extra_joints = vertices2joints(self.J_regressor_extra, smpl_output.vertices)
@@ -50,9 +71,122 @@ class SMPL(_SMPL):
                                   full_pose=smpl_output.full_pose)
         return output
 
+    @float32
+    def forward_joints(self, betas=None, body_pose=None, global_orient=None, pose2rot=True, **kwargs):
+        """Joints-only evaluation for losses on the 49 joints: only the vertices the joints depend on
+        are skinned and no mesh is built. Takes the arguments of forward, vertices of the output is None.
+        """
+        v_shaped, J = self.shape_components(betas, joints_only=True)
+        _, joints, smpl_joints = self.skin(global_orient, body_pose, v_shaped, J, joints_only=True, pose2rot=pose2rot)
+        joints_J24 = joints[:, -24:, :]
+        joints_J19 = joints_J24[:, constants.J24_TO_J19, :]
+        return self.ModelOutput(global_orient=global_orient,
+                                body_pose=body_pose,
+                                joints=joints,
+                                joints_J19=joints_J19,
+                                smpl_joints=smpl_joints,
+                                betas=betas)
+
+    def shape_components(self, betas, joints_only=False):
+        """Betas dependent part of SMPL.
+        Returns:
+            v_shaped: (B, 6890, 3) shaped template, only the rows of joint_vertex_ids if joints_only
+            J: (B, 24, 3) rest pose joints
+        """
+        if joints_only:
+            v_shaped = self.v_template_sub + blend_shapes(betas, self.shapedirs_sub)
+            J = self.J_template + blend_shapes(betas, self.J_shapedirs)
+        else:
+            v_shaped = self.v_template + blend_shapes(betas, self.shapedirs)
+            J = vertices2joints(self.J_regressor, v_shaped)
+        return v_shaped, J
+
+    def skin(self, global_orient, body_pose, v_shaped, J, joints_only=False, pose2rot=True):
+        """Pose dependent part of SMPL, linear blend skinning as in smplx.lbs.
+        Input:
+            global_orient, body_pose: axis-angle, or rotation matrices if not pose2rot
+            v_shaped, J: from shape_components, with the same joints_only
+        Returns:
+            vertices: (B, 6890, 3) posed vertices, only the rows of joint_vertex_ids if joints_only
+            joints: (B, 49, 3) joints, as returned by forward
+            smpl_joints: (B, 24, 3) posed SMPL joints
+        """
+        batch_size = global_orient.shape[0]
+        if pose2rot:
+            full_pose = torch.cat([global_orient.reshape(batch_size, -1), body_pose.reshape(batch_size, -1)], dim=1)
+            rot_mats = batch_rodrigues(full_pose.view(-1, 3)).view(batch_size, -1, 3, 3)
+        else:
+            rot_mats = torch.cat([global_orient.reshape(batch_size, -1, 3, 3), body_pose.reshape(batch_size, -1, 3, 3)], dim=1)
+
+        if joints_only:
+            posedirs, lbs_weights = self.posedirs_sub, self.lbs_weights_sub
+        else:
+            posedirs, lbs_weights = self.posedirs, self.lbs_weights
+        ident = torch.eye(3, dtype=rot_mats.dtype, device=rot_mats.device)
+        pose_feature = (rot_mats[:, 1:] - ident).view(batch_size, -1)
+        v_posed = v_shaped.expand(batch_size, -1, -1) + torch.matmul(pose_feature, posedirs).view(batch_size, -1, 3)
+
+        J_transformed, A = batch_rigid_transform(rot_mats, J.expand(batch_size, -1, -1), self.parents, dtype=rot_mats.dtype)
+        T = torch.matmul(lbs_weights, A.view(batch_size, -1, 16)).view(batch_size, -1, 4, 4)
+        vertices = torch.matmul(T[:, :, :3, :3], v_posed.unsqueeze(-1)).squeeze(-1) + T[:, :, :3, 3]
+
+        if joints_only:
+            joints = torch.cat([J_transformed, vertices[:, self.selector_pos],
+                                vertices2joints(self.J_regressor_extra_sub, vertices)], dim=1)
+        else:
+            joints = torch.cat([self.vertex_joint_selector(vertices, J_transformed),
+                                vertices2joints(self.J_regressor_extra, vertices)], dim=1)
+        return vertices, joints[:, self.joint_map, :], J_transformed
+
+class FittingSMPL(object):
+    """SMPL evaluation for fitting loops. The betas dependent part (shaped template and rest
+    joints) is cached while the same betas tensor is passed without gradient, e.g. during the
+    camera stage of SMPLify, so that only the pose dependent part is recomputed. With
+    joints_only only the vertices the 49 joints depend on are skinned.
+    """
+    def __init__(self, smpl):
+        self.smpl = smpl
+        self.cache = None
+
+    def shape_components(self, betas, joints_only):
+        if betas.requires_grad:
+            return self.smpl.shape_components(betas, joints_only)
+        # the cache keeps the betas tensor alive, so identity and version identify its content
+        if self.cache is not None:
+            cached_betas, version, cached_joints_only, components = self.cache
+            if cached_betas is betas and version == betas._version and cached_joints_only == joints_only:
+                return components
+        components = self.smpl.shape_components(betas, joints_only)
+        self.cache = (betas, betas._version, joints_only, components)
+        return components
+
+    @float32
+    def __call__(self, global_orient, body_pose, betas, joints_only=False):
+        """
+        Returns:
+            vertices: (B, 6890, 3), None if joints_only
+            joints: (B, 49, 3) as SMPL.forward
+        """
+        v_shaped, J = self.shape_components(betas, joints_only)
+        vertices, joints, _ = self.smpl.skin(global_orient, body_pose, v_shaped, J, joints_only)
+        return (None if joints_only else vertices), joints
+
+# SMPL layers shared by the losses, keyed by (device, dtype)
+_smpl_models = {}
+
+def get_smpl(device='cuda', dtype=torch.float32):
+    """Shared SMPL layer, loaded from disk once per device and dtype. It takes any batch size
+    as long as betas, body_pose and global_orient are all given. Not to be trained.
+    """
+    key = (str(torch.device(device)), dtype)
+    if key not in _smpl_models:
+        smpl = SMPL(SMPL_MODEL_DIR, batch_size=1, create_transl=False, dtype=dtype).to(device)
+        smpl.requires_grad_(False)
+        _smpl_models[key] = smpl
+    return _smpl_models[key]
+
 def get_smpl_faces():
-    smpl = SMPL(SMPL_MODEL_DIR, batch_size=1, create_transl=False)
-    return smpl.faces
+    return get_smpl('cpu').faces
 
 def get_part_joints(smpl_joints):
     batch_size = smpl_joints.shape[0]
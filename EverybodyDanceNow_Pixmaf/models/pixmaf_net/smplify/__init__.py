@@ -1 +1,3 @@
 from .smplify import SMPLify
+from .best_fits import BestFitStore, smpl_from_fits
+from .async_refiner import AsyncSMPLify
@@ -0,0 +1,173 @@
+import queue
+import threading
+import torch
+
+from .best_fits import unique_updates
+
+class AsyncSMPLify(object):
+    """Runs SMPLify on a background thread so that the training step does not wait for it.
+
+    The trainer submits the frames of every step (network prediction, keypoints and the loss of
+    the stored best fit) and, at the start of the next steps, applies whatever refinements are
+    finished. A refinement replaces the best fit of a frame if its loss is lower than the loss
+    of the stored fit, the rule of the synchronous path. A frame is often submitted twice in a
+    row (as next and then as current frame), so the stored loss is the lower one of the loss at
+    submission time and the loss of the last refinement applied to the frame.
+
+    Jobs are merged into batches of about batch_size frames. When the queue is full new jobs are
+    dropped, and jobs older than max_staleness training steps when the worker picks them up are
+    discarded, so the worker never lags far behind the network.
+    """
+    def __init__(self, smplify, queue_size=8, batch_size=64, max_staleness=50, device='cuda'):
+        """
+        Input:
+            smplify: SMPLify instance run by the worker
+            queue_size: maximum number of pending jobs (training steps)
+            batch_size: number of frames the worker fits together
+            max_staleness: jobs submitted more than this many steps ago are discarded
+            device: training device
+        """
+        self.smplify = smplify
+        self.batch_size = batch_size
+        self.max_staleness = max_staleness
+        self.device = torch.device(device)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue()
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        # loss of the last refinement applied to every frame, with a spare last row, see apply
+        self.applied_loss = None
+
+        self.step = 0
+        self.counters = {'submitted': 0, 'dropped': 0, 'stale': 0, 'refined': 0, 'applied': 0,
+                         'last_batch': 0, 'staleness': 0., 'camera_iters': 0., 'body_iters': 0.}
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame_ids, pose, betas, cam_t, camera_center, keypoints_2d, opt_joint_loss):
+        """Queues the frames of a training step, never blocks.
+        Input:
+            frame_ids: (B,) frame ids
+            pose, betas, cam_t: (B, 72), (B, 10), (B, 3) initial estimates, e.g. the network prediction
+            camera_center: (B, 2) camera centers
+            keypoints_2d: (B, 49, 3) keypoints in pixels with confidence
+            opt_joint_loss: (B,) loss of the stored best fits
+        Returns:
+            False if the job was dropped because the queue is full
+        """
+        self.step += 1
+        # own copies, the trainer may reuse its tensors
+        job = [t.detach().clone() for t in (frame_ids, pose, betas, cam_t, camera_center, keypoints_2d, opt_joint_loss)]
+        ready = None
+        if self.stream is not None:
+            ready = torch.cuda.Event()
+            ready.record()
+        try:
+            self.jobs.put_nowait((self.step, ready, job))
+        except queue.Full:
+            self.counters['dropped'] += len(frame_ids)
+            return False
+        self.counters['submitted'] += len(frame_ids)
+        return True
+
+    def apply(self, best_fits):
+        """Writes the finished refinements that improve on the stored fits into best_fits.
+        Refinements of the same frame are compared with each other, the best one is kept.
+        Input:
+            best_fits: BestFitStore
+        Returns:
+            number of updated fits, as a tensor on the training device
+        """
+        if self.error is not None:
+            raise RuntimeError('SMPLify worker failed') from self.error
+        count = torch.zeros((), dtype=torch.long, device=self.device)
+        if self.applied_loss is None:
+            self.applied_loss = torch.full((len(best_fits) + 1,), float('inf'), device=self.device)
+        while True:
+            try:
+                frame_ids, fits, new_loss, opt_joint_loss, done = self.results.get_nowait()
+            except queue.Empty:
+                return count
+            if self.stream is not None:
+                # computed on the worker stream, the current stream waits until they are written
+                current = torch.cuda.current_stream(self.device)
+                current.wait_event(done)
+                for t in [frame_ids, new_loss, opt_joint_loss] + list(fits.values()):
+                    t.record_stream(current)
+            index = frame_ids.to(self.device).long()
+            stored_loss = torch.minimum(opt_joint_loss, self.applied_loss[index])
+            update = unique_updates(index, new_loss < stored_loss, new_loss)
+            spare = torch.full_like(index, len(self.applied_loss) - 1)
+            self.applied_loss.index_copy_(0, torch.where(update, index, spare), new_loss)
+            best_fits.scatter(index, fits, update, new_loss)
+            count += update.sum()
+            self.counters['applied'] += len(frame_ids)
+
+    def metrics(self):
+        """Queue depth and job counters, in frames."""
+        metrics = dict(self.counters)
+        metrics['queue_depth'] = self.jobs.qsize()
+        return metrics
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _next_batch(self):
+        # blocks for the first job, then takes what is queued up to batch_size frames
+        batch = []
+        size = 0
+        while size < self.batch_size:
+            try:
+                item = self.jobs.get(block=len(batch) == 0)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            step, ready, job = item
+            staleness = self.step - step
+            if staleness > self.max_staleness:
+                self.counters['stale'] += len(job[0])
+                continue
+            if ready is not None:
+                self.stream.wait_event(ready)
+            batch.append((staleness, job))
+            size += len(job[0])
+        return batch, False
+
+    def _run(self):
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if len(batch) == 0:
+                    continue
+                if self.stream is None:
+                    self._refine(batch)
+                else:
+                    with torch.cuda.stream(self.stream):
+                        self._refine(batch)
+                    # the inputs are freed by this thread, wait until the stream is done with them
+                    self.stream.synchronize()
+        except Exception as e:
+            self.error = e
+
+    def _refine(self, batch):
+        frame_ids, pose, betas, cam_t, camera_center, keypoints_2d, opt_joint_loss = \
+            [torch.cat(t, dim=0) for t in zip(*[job for _, job in batch])]
+        _, _, new_pose, new_betas, _, new_joint_loss = self.smplify(pose, betas, cam_t, camera_center, keypoints_2d)
+        new_joint_loss = new_joint_loss.mean(dim=-1)
+        done = None
+        if self.stream is not None:
+            # marks the end of the work on the results, apply waits for it
+            done = torch.cuda.Event()
+            done.record(self.stream)
+        self.results.put((frame_ids, {'pose': new_pose, 'betas': new_betas}, new_joint_loss, opt_joint_loss, done))
+
+        self.counters['refined'] += len(frame_ids)
+        self.counters['last_batch'] = len(frame_ids)
+        self.counters['staleness'] = sum(s for s, _ in batch) / float(len(batch))
+        iters_used = getattr(self.smplify, 'iters_used', None)
+        if iters_used is not None:
+            self.counters['camera_iters'] = iters_used['camera'].float().mean().item()
+            self.counters['body_iters'] = iters_used['body'].float().mean().item()
@@ -0,0 +1,245 @@
+import os
+import pickle
+import numpy as np
+import torch
+
+def write_rows(npy_path, ids, rows):
+    """Overwrites rows of a float32 .npy file in place, touching only those rows."""
+    with open(npy_path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        row_bytes = 4 * int(np.prod(shape[1:]))
+        rows = np.ascontiguousarray(rows, dtype=np.float32)
+        for i, row in zip(ids, rows):
+            os.pwrite(f.fileno(), row.tobytes(), offset + int(i) * row_bytes)
+        os.fsync(f.fileno())
+
+class BestFitStore(object):
+    """Best SMPLify fit of every training frame (SPIN style), as preallocated tensors.
+    Rows are read and written in batches by frame-id tensors. With the tables on the
+    training device neither gather nor scatter waits for the host.
+
+    Only pose and betas (82 floats per frame) are stored, vertices and joints are rebuilt
+    from them with smpl_from_fits, as in SPIN.
+
+    A store opened from a directory (see open) is backed by one memory-mapped .npy file per
+    field. The tables are read on first use, updated rows are marked in a dirty bitmap and
+    flush writes only those rows, through a journal so that a crash never leaves a half
+    written file behind.
+    """
+    FIELDS = ['pose', 'betas']
+    # fields of older best_fits.pkl files that are functions of pose and betas
+    DERIVED = ['joints3d', 'verts']
+    JOURNAL = 'journal.npz'
+
+    def __init__(self, best_fits, device='cuda', on_device=True, path=None):
+        """
+        Input:
+            best_fits: dict of per-frame arrays, e.g. the content of best_fits.pkl
+            device: training device
+            on_device: keep the tables on device, otherwise in pinned host memory
+            path: directory backing the store, set by open
+        """
+        self.device = torch.device(device)
+        self.on_device = on_device
+        self.path = path
+        # anything else in the pickle is passed through unchanged
+        self.extra = {k: v for k, v in best_fits.items() if k not in self.FIELDS + self.DERIVED}
+        self.source = {k: best_fits[k] for k in self.FIELDS}
+        self.dtypes = {k: np.asarray(best_fits[k][:0]).dtype for k in self.FIELDS}
+        self.tables = None
+        self.dirty = None
+
+    @classmethod
+    def load(cls, path, device='cuda', on_device=True):
+        with open(path, 'rb') as f:
+            return cls(pickle.load(f), device, on_device)
+
+    @classmethod
+    def open(cls, path, device='cuda', on_device=True):
+        """Memory-mapped store in directory path, created from path + '.pkl' on first use."""
+        if not os.path.isdir(path):
+            cls.convert(path + '.pkl', path)
+        cls.replay_journal(path)
+        best_fits = {k: np.load(os.path.join(path, k + '.npy'), mmap_mode='r') for k in cls.FIELDS}
+        if os.path.exists(os.path.join(path, 'extra.pkl')):
+            with open(os.path.join(path, 'extra.pkl'), 'rb') as f:
+                best_fits.update(pickle.load(f))
+        return cls(best_fits, device, on_device, path)
+
+    @classmethod
+    def convert(cls, pkl_path, path):
+        """Writes the fields of a best_fits.pkl as one float32 .npy file each. The pickle is renamed
+        to best_fits.pkl.converted, training reads and updates the directory from then on."""
+        print('converting %s to %s' % (pkl_path, path))
+        with open(pkl_path, 'rb') as f:
+            best_fits = pickle.load(f)
+        tmp_path = path + '.tmp'
+        if not os.path.exists(tmp_path):
+            os.makedirs(tmp_path)
+        for k in cls.FIELDS:
+            np.save(os.path.join(tmp_path, k + '.npy'), np.asarray(best_fits[k], dtype=np.float32))
+        extra = {k: v for k, v in best_fits.items() if k not in cls.FIELDS + cls.DERIVED}
+        if extra:
+            with open(os.path.join(tmp_path, 'extra.pkl'), 'wb') as f:
+                pickle.dump(extra, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        # no stale copy under the old name
+        os.replace(pkl_path, pkl_path + '.converted')
+        print('%s is no longer used, kept as %s' % (pkl_path, pkl_path + '.converted'))
+
+    @classmethod
+    def replay_journal(cls, path):
+        """Applies a journal left behind by an interrupted flush. Replaying is idempotent."""
+        journal_path = os.path.join(path, cls.JOURNAL)
+        if not os.path.exists(journal_path):
+            return 0
+        journal = np.load(journal_path)
+        ids = journal['ids']
+        for k in cls.FIELDS:
+            write_rows(os.path.join(path, k + '.npy'), ids, journal[k])
+        os.remove(journal_path)
+        return len(ids)
+
+    @property
+    def fields(self):
+        if self.tables is None:
+            # read lazily, at model init only the headers are touched
+            self.tables = {}
+            for k in self.FIELDS:
+                # a copy, the memory map itself is read-only. The last row is a spare that takes
+                # the writes of frames that are not updated, see scatter
+                source = np.asarray(self.source[k])
+                table = np.zeros((len(source) + 1,) + source.shape[1:], dtype=np.float32)
+                table[:-1] = source
+                table = torch.from_numpy(table)
+                if self.on_device:
+                    table = table.to(self.device)
+                elif self.device.type == 'cuda':
+                    table = table.pin_memory()
+                self.tables[k] = table
+            self.dirty = torch.zeros(len(table), dtype=torch.bool, device=table.device)
+        return self.tables
+
+    def __len__(self):
+        return len(self.source['pose'])
+
+    def _index(self, frame_ids, table):
+        return frame_ids.to(table.device, non_blocking=True).long().view(-1)
+
+    def gather(self, frame_ids):
+        """Best fits of a batch of frames.
+        Input:
+            frame_ids: (B,) tensor
+        Returns:
+            dict of (B, ...) float tensors on the training device
+        """
+        fits = {}
+        for k, table in self.fields.items():
+            fits[k] = table.index_select(0, self._index(frame_ids, table)).to(self.device, non_blocking=True)
+        return fits
+
+    def scatter(self, frame_ids, fits, update=None, loss=None):
+        """Writes fits back for the frames where update is set.
+        A frame id may occur more than once, e.g. as current and as next frame. Then only one
+        of its rows is written, see unique_updates, since index_copy_ with duplicate indices
+        has no defined winner on the GPU.
+        Input:
+            frame_ids: (B,) tensor
+            fits: dict of (B, ...) tensors, e.g. from gather
+            update: optional (B,) bool tensor, all frames if None
+            loss: optional (B,) loss of the fits, of duplicate frames the lowest one is written
+        """
+        tables = self.fields
+        index = self._index(frame_ids, self.dirty)
+        device = self.dirty.device
+        if update is not None:
+            update = update.to(device, non_blocking=True)
+        if loss is not None:
+            loss = loss.to(device, non_blocking=True)
+        update = unique_updates(index, update, loss)
+        # rows that are not written go to the spare last row, decided without leaving the device
+        index = torch.where(update, index, torch.full_like(index, len(self.dirty) - 1))
+
+        for k, table in tables.items():
+            value = fits[k].detach().to(table.device, non_blocking=True).to(table.dtype)
+            table.index_copy_(0, index, value)
+        self.dirty.index_fill_(0, index, True)
+
+    def flush(self):
+        """Writes the rows updated since the last flush to the backing files.
+        Returns:
+            number of rows written
+        """
+        if self.path is None or self.tables is None:
+            return 0
+        ids = self.dirty[:-1].nonzero().view(-1)
+        if len(ids) == 0:
+            return 0
+
+        # the journal is the commit point: it is complete once renamed, and replayed after a crash
+        rows = {k: table.index_select(0, ids.to(table.device)).cpu().numpy() for k, table in self.tables.items()}
+        journal_path = os.path.join(self.path, self.JOURNAL)
+        with open(journal_path + '.tmp', 'wb') as f:
+            np.savez(f, ids=ids.cpu().numpy(), **rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(journal_path + '.tmp', journal_path)
+        self.replay_journal(self.path)
+
+        self.dirty.index_fill_(0, ids, False)
+        return len(ids)
+
+    def to_dict(self):
+        """Per-frame numpy arrays in the layout of best_fits.pkl."""
+        best_fits = dict(self.extra)
+        best_fits.update({k: self.fields[k][:-1].cpu().numpy().astype(self.dtypes[k]) for k in self.FIELDS})
+        return best_fits
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self.to_dict(), f, pickle.HIGHEST_PROTOCOL)
+
+def unique_updates(frame_ids, update=None, loss=None):
+    """Keeps at most one updated row per frame id: the one with the lowest loss, the last one
+    on ties or without loss. Pairwise on the (small) batch, without leaving the device.
+    Input:
+        frame_ids: (B,) tensor
+        update: optional (B,) bool tensor, all rows if None
+        loss: optional (B,) tensor
+    Returns:
+        (B,) bool tensor, update with the replaced duplicates cleared
+    """
+    index = frame_ids.view(-1)
+    if update is None:
+        update = torch.ones_like(index, dtype=torch.bool)
+    update = update.view(-1)
+    position = torch.arange(len(index), device=index.device)
+    later = position.view(1, -1) > position.view(-1, 1)
+    if loss is None:
+        wins = later
+    else:
+        loss = loss.view(-1)
+        wins = (loss.view(1, -1) < loss.view(-1, 1)) | ((loss.view(1, -1) == loss.view(-1, 1)) & later)
+    # replaced[i, j]: the updated row j is written instead of row i
+    replaced = (index.view(1, -1) == index.view(-1, 1)) & update.view(1, -1) & wins
+    return update & ~replaced.any(dim=1)
+
+def smpl_from_fits(smpl, *fits):
+    """Vertices and joints of best fits, in one SMPL forward for all of them.
+    Input:
+        smpl: SMPL model of models/pixmaf_net/models/smpl.py
+        fits: dicts from BestFitStore.gather
+    Returns:
+        one (vertices, joints) pair per dict of fits
+    """
+    pose = torch.cat([f['pose'] for f in fits], dim=0)
+    betas = torch.cat([f['betas'] for f in fits], dim=0)
+    with torch.no_grad():
+        smpl_output = smpl(global_orient=pose[:, :3], body_pose=pose[:, 3:], betas=betas)
+    sizes = [len(f['pose']) for f in fits]
+    return list(zip(smpl_output.vertices.split(sizes), smpl_output.joints.split(sizes)))
@@ -54,11 +54,13 @@ def body_fitting_loss(body_pose, betas, model_joints, camera_t, camera_center,
 
     if output == 'sum':
         return total_loss.sum()
+    elif output == 'per_sample':
+        return total_loss
     elif output == 'reprojection':
         return reprojection_loss
 
 def camera_fitting_loss(model_joints, camera_t, camera_t_est, camera_center, joints_2d, joints_conf,
-                        focal_length=5000, depth_loss_weight=100):
+                        focal_length=5000, depth_loss_weight=100, output='sum'):
     """
     Loss function for camera optimization.
     """
@@ -87,4 +89,6 @@ def camera_fitting_loss(model_joints, camera_t, camera_t_est, camera_center, joi
     depth_loss = (depth_loss_weight ** 2) * (camera_t[:, 2] - camera_t_est[:, 2]) ** 2
 
     total_loss = reprojection_loss + depth_loss
+    if output == 'per_sample':
+        return total_loss
     return total_loss.sum()
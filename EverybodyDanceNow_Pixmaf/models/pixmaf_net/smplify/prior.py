@@ -29,6 +29,7 @@ import numpy as np
 
 import torch
 import torch.nn as nn
+from ..utils.amp import float32
 
 DEFAULT_DTYPE = torch.float32
 
@@ -224,6 +225,7 @@ class MaxMixturePrior(nn.Module):
 
         return weight_component + log_likelihoods[:, min_idx]
 
+    @float32
     def forward(self, pose, betas):
         if self.use_merged:
             return self.merged_log_likelihood(pose, betas)
@@ -1,9 +1,10 @@
 import torch
 import os
 
-from ..models.smpl import SMPL
+from ..models.smpl import get_smpl, FittingSMPL
 from .losses import camera_fitting_loss, body_fitting_loss
 from ..core import path_config, constants
+from ..utils.amp import float32
 
 # For the GMM prior, we use the GMM implementation of SMPLify-X
 # https://github.com/vchoutas/smplify-x/blob/master/smplifyx/prior.py
@@ -16,12 +17,30 @@ class SMPLify():
                  batch_size=1,
                  num_iters=100,
                  focal_length=5000,
-                 device=torch.device('cuda')):
+                 device=torch.device('cuda'),
+                 rel_tol=0.,
+                 patience=5,
+                 check_every=10,
+                 camera_optimizer='adam'):
+        """
+        Input:
+            batch_size: unused, kept for compatibility, the batch size is taken from the inputs
+            rel_tol: a sample has converged when its loss changed by less than rel_tol (relative)
+                for patience iterations in a row, 0 always runs num_iters iterations
+            check_every: converged samples leave the batch every check_every iterations
+            camera_optimizer: 'adam' or 'lbfgs' for the camera stage
+        """
 
         # Store options
         self.device = device
         self.focal_length = focal_length
         self.step_size = step_size
+        self.rel_tol = rel_tol
+        self.patience = patience
+        self.check_every = check_every
+        self.camera_optimizer = camera_optimizer
+        # iterations every sample used in the last call, {'camera': (B,), 'body': (B,)}
+        self.iters_used = None
 
         # Ignore the the following joints for the fitting process
         # ign_joints = ['OP Neck', 'OP RHip', 'OP LHip', 'Right Hip', 'Left Hip']
@@ -33,18 +52,21 @@ class SMPLify():
                                           num_gaussians=8,
                                           dtype=torch.float32).to(device)
         # Load SMPL model
-        self.smpl = SMPL(path_config.SMPL_MODEL_DIR,
-                         batch_size=batch_size,
-                         create_transl=False).to(self.device)
+        # shared with the losses, the fitting only needs it read-only
+        self.smpl = get_smpl(self.device)
+        # the fitting losses only need the joints, and betas are fixed during the camera stage
+        self.fitting_smpl = FittingSMPL(self.smpl)
 
+    @float32
     def __call__(self, init_pose, init_betas, init_cam_t, camera_center, keypoints_2d):
-        """Perform body fitting.
+        """Perform body fitting. The batch size is taken from the inputs, every sample may have
+        its own image resolution and camera center.
         Input:
-            init_pose: SMPL pose estimate
-            init_betas: SMPL betas estimate
-            init_cam_t: Camera translation estimate
-            camera_center: Camera center location
-            keypoints_2d: Keypoints used for the optimization
+            init_pose: (B, 72) SMPL pose estimate
+            init_betas: (B, 10) SMPL betas estimate
+            init_cam_t: (B, 3) Camera translation estimate
+            camera_center: (B, 2) or (2,) Camera center location
+            keypoints_2d: (B, 49, 3) Keypoints used for the optimization
         Returns:
             vertices: Vertices of optimized shape
             joints: 3D joints of optimized shape
@@ -55,13 +77,11 @@ class SMPLify():
         """
 
         batch_size = init_pose.shape[0]
+        camera_center = camera_center.expand(batch_size, 2)
 
-        # Make camera translation a learnable parameter
-        camera_translation = init_cam_t.clone()
-
-        # Get joint confidence
+        # Get joint confidence, a copy because ignored joints are zeroed below
         joints_2d = keypoints_2d[:, :, :2]
-        joints_conf = keypoints_2d[:, :, -1]
+        joints_conf = keypoints_2d[:, :, -1].clone()
 
         # Split SMPL pose to body pose and global orientation
         body_pose = init_pose[:, 3:].detach().clone()
@@ -70,52 +90,32 @@ class SMPLify():
 
         # Step 1: Optimize camera translation and body orientation
         # Optimize only camera translation and body orientation
-        body_pose.requires_grad=False
-        betas.requires_grad=False
-        global_orient.requires_grad=True
-        camera_translation.requires_grad = True
-
-        camera_opt_params = [global_orient, camera_translation]
-        camera_optimizer = torch.optim.Adam(camera_opt_params, lr=self.step_size, betas=(0.9, 0.999))
-
-        for i in range(self.num_iters):
-            smpl_output = self.smpl(global_orient=global_orient,
-                                    body_pose=body_pose,
-                                    betas=betas)
-            model_joints = smpl_output.joints
-            loss = camera_fitting_loss(model_joints, camera_translation,
+        def camera_loss(global_orient, camera_translation, body_pose, betas, init_cam_t, camera_center, joints_2d, joints_conf):
+            _, model_joints = self.fitting_smpl(global_orient, body_pose, betas, joints_only=True)
+            return camera_fitting_loss(model_joints, camera_translation,
                                        init_cam_t, camera_center,
-                                       joints_2d, joints_conf, focal_length=self.focal_length)
-            camera_optimizer.zero_grad()
-            loss.backward()
-            camera_optimizer.step()
+                                       joints_2d, joints_conf, focal_length=self.focal_length,
+                                       output='per_sample')
 
-        # Fix camera translation after optimizing camera
-        camera_translation.requires_grad = False
+        (global_orient, camera_translation), camera_iters = self.fit(
+            [global_orient, init_cam_t], [body_pose, betas, init_cam_t, camera_center, joints_2d, joints_conf],
+            camera_loss, self.camera_optimizer)
 
         # Step 2: Optimize body joints
-        # Optimize only the body pose and global orientation of the body
-        body_pose.requires_grad=True
-        betas.requires_grad=True
-        global_orient.requires_grad=True
-        camera_translation.requires_grad = False
-        body_opt_params = [body_pose, betas, global_orient]
-
+        # Optimize only the body pose and global orientation of the body, camera translation is fixed
         # For joints ignored during fitting, set the confidence to 0
         joints_conf[:, self.ign_joints] = 0.
-        
-        body_optimizer = torch.optim.Adam(body_opt_params, lr=self.step_size, betas=(0.9, 0.999))
-        for i in range(self.num_iters):
-            smpl_output = self.smpl(global_orient=global_orient,
-                                    body_pose=body_pose,
-                                    betas=betas)
-            model_joints = smpl_output.joints
-            loss = body_fitting_loss(body_pose, betas, model_joints, camera_translation, camera_center,
+
+        def body_loss(body_pose, betas, global_orient, camera_translation, camera_center, joints_2d, joints_conf):
+            _, model_joints = self.fitting_smpl(global_orient, body_pose, betas, joints_only=True)
+            return body_fitting_loss(body_pose, betas, model_joints, camera_translation, camera_center,
                                      joints_2d, joints_conf, self.pose_prior,
-                                     focal_length=self.focal_length)
-            body_optimizer.zero_grad()
-            loss.backward()
-            body_optimizer.step()
+                                     focal_length=self.focal_length, output='per_sample')
+
+        (body_pose, betas, global_orient), body_iters = self.fit(
+            [body_pose, betas, global_orient], [camera_translation, camera_center, joints_2d, joints_conf],
+            body_loss, 'adam')
+        self.iters_used = {'camera': camera_iters, 'body': body_iters}
 
         # Get final loss value
         with torch.no_grad():
@@ -135,23 +135,110 @@ class SMPLify():
 
         return vertices, joints, pose, betas, camera_translation, reprojection_loss
 
+    def fit(self, opt_params, const_params, loss_fn, optimizer='adam'):
+        """Minimizes a per-sample loss for num_iters iterations. With rel_tol > 0 samples whose
+        loss has converged are dropped from the batch, the others continue unchanged (Adam works
+        element-wise, so the samples do not influence each other).
+        Input:
+            opt_params: list of (B, ...) tensors to optimize
+            const_params: list of (B, ...) tensors that are passed on to loss_fn
+            loss_fn: function of *opt_params, *const_params returning the (B,) loss
+            optimizer: 'adam' or 'lbfgs'
+        Returns:
+            optimized opt_params
+            (B,) number of iterations every sample used
+        """
+        batch_size = opt_params[0].shape[0]
+        results = [p.detach().clone() for p in opt_params]
+        iters = torch.zeros(batch_size, dtype=torch.long, device=results[0].device)
+        active = torch.arange(batch_size, device=results[0].device)
+        params = [p.detach().clone().requires_grad_() for p in opt_params]
+        consts = list(const_params)
+        opt = self.make_optimizer(optimizer, params)
+        prev_loss = None
+        stalled = torch.zeros(batch_size, dtype=torch.long, device=results[0].device)
+
+        for i in range(self.num_iters):
+            if optimizer == 'lbfgs':
+                def closure():
+                    opt.zero_grad()
+                    loss = loss_fn(*(params + consts)).sum()
+                    loss.backward()
+                    return loss
+                opt.step(closure)
+                with torch.no_grad():
+                    loss = loss_fn(*(params + consts))
+            else:
+                loss = loss_fn(*(params + consts))
+                opt.zero_grad()
+                loss.sum().backward()
+                opt.step()
+            iters.index_add_(0, active, torch.ones_like(active))
+
+            if self.rel_tol <= 0:
+                continue
+            loss = loss.detach()
+            if prev_loss is not None:
+                converged = (prev_loss - loss).abs() <= self.rel_tol * prev_loss.abs()
+                stalled = torch.where(converged, stalled + 1, torch.zeros_like(stalled))
+            prev_loss = loss
+
+            # the active set is only changed every check_every iterations, each check waits for the device
+            if (i + 1) % self.check_every != 0:
+                continue
+            keep = stalled < self.patience
+            num_keep = int(keep.sum())
+            if num_keep == len(keep):
+                continue
+            done = ~keep
+            for result, p in zip(results, params):
+                result[active[done]] = p.detach()[done]
+            if num_keep == 0:
+                return results, iters
+            active = active[keep]
+            new_params = [p.detach()[keep].clone().requires_grad_() for p in params]
+            opt = self.make_optimizer(optimizer, new_params, opt, params, keep)
+            params = new_params
+            consts = [c[keep] for c in consts]
+            prev_loss = prev_loss[keep]
+            stalled = stalled[keep]
+
+        for result, p in zip(results, params):
+            result[active] = p.detach()
+        return results, iters
+
+    def make_optimizer(self, optimizer, params, old_opt=None, old_params=None, keep=None):
+        """Optimizer for params, optionally taking over the per-sample Adam state of the rows keep
+        of old_params."""
+        if optimizer == 'lbfgs':
+            # one quasi-Newton iteration per step, over the whole batch. The history is not carried over
+            return torch.optim.LBFGS(params, lr=1., max_iter=1, line_search_fn='strong_wolfe')
+        opt = torch.optim.Adam(params, lr=self.step_size, betas=(0.9, 0.999))
+        if old_opt is not None:
+            for p, old_p in zip(params, old_params):
+                opt.state[p] = {k: v[keep] if torch.is_tensor(v) and v.dim() > 0 else v
+                                for k, v in old_opt.state[old_p].items()}
+        return opt
+
+    @float32
     def get_fitting_loss(self, pose, betas, cam_t, camera_center, keypoints_2d):
         """Given body and camera parameters, compute reprojection loss value.
         Input:
-            pose: SMPL pose parameters
-            betas: SMPL beta parameters
-            cam_t: Camera translation
-            camera_center: Camera center location
-            keypoints_2d: Keypoints used for the optimization
+            pose: (B, 72) SMPL pose parameters
+            betas: (B, 10) SMPL beta parameters
+            cam_t: (B, 3) Camera translation
+            camera_center: (B, 2) or (2,) Camera center location
+            keypoints_2d: (B, 49, 3) Keypoints used for the optimization
         Returns:
             reprojection_loss: Final joint reprojection loss
         """
 
         batch_size = pose.shape[0]
+        camera_center = camera_center.expand(batch_size, 2)
 
-        # Get joint confidence
+        # Get joint confidence, a copy so that the keypoints of the caller are not modified
         joints_2d = keypoints_2d[:, :, :2]
-        joints_conf = keypoints_2d[:, :, -1]
+        joints_conf = keypoints_2d[:, :, -1].clone()
         # For joints ignored during fitting, set the confidence to 0
         joints_conf[:, self.ign_joints] = 0.
 
@@ -160,9 +247,10 @@ class SMPLify():
         global_orient = pose[:, :3]
 
         with torch.no_grad():
+            # only the joints are needed
             smpl_output = self.smpl(global_orient=global_orient,
                                     body_pose=body_pose,
-                                    betas=betas, return_full_pose=True)
+                                    betas=betas, joints_only=True)
             model_joints = smpl_output.joints
             reprojection_loss = body_fitting_loss(body_pose, betas, model_joints, cam_t, camera_center,
                                                   joints_2d, joints_conf, self.pose_prior,
@@ -0,0 +1,44 @@
+import contextlib
+import functools
+import torch
+
+"""
+Mixed precision helpers. Training with --amp runs the forward passes under torch.autocast; the
+numerically sensitive parts of the model (SMPL skinning, rotation conversions, the GMM pose prior,
+SMPLify and the renderer) are decorated with float32 and keep running in float32.
+"""
+
+def autocast_device_types():
+    """Device types with autocast enabled in the current thread."""
+    if hasattr(torch, 'get_autocast_dtype'):
+        # torch >= 2.4 takes the device type
+        return [d for d in ('cuda', 'cpu') if torch.is_autocast_enabled(d)]
+    return [d for d, enabled in (('cuda', torch.is_autocast_enabled()), ('cpu', torch.is_autocast_cpu_enabled())) if enabled]
+
+def _to_float32(x):
+    # float64 inputs are left alone
+    if torch.is_tensor(x) and x.dtype in (torch.float16, torch.bfloat16):
+        return x.float()
+    return x
+
+def float32(fn):
+    """Decorator: when fn is called under autocast, autocast is disabled inside it and its half
+    precision tensor arguments are cast to float32. Without autocast fn is called unchanged."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        device_types = autocast_device_types()
+        if not device_types:
+            return fn(*args, **kwargs)
+        with contextlib.ExitStack() as stack:
+            for device_type in device_types:
+                stack.enter_context(torch.autocast(device_type, enabled=False))
+            args = [_to_float32(a) for a in args]
+            kwargs = {k: _to_float32(v) for k, v in kwargs.items()}
+            return fn(*args, **kwargs)
+    return wrapper
+
+def grad_scaler(device_type='cuda', enabled=True):
+    """GradScaler of torch.amp, or of torch.cuda.amp on older versions."""
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device_type, enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
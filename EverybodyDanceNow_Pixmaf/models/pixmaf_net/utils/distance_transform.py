@@ -0,0 +1,92 @@
+import torch
+
+"""
+Exact distance transforms of binary masks and the silhouette loss built on top of them.
+All functions work on batches of masks and run on whatever device the masks live on.
+"""
+def _row_distance(mask):
+    """1D distance to the nearest foreground pixel along the last axis.
+    Input:
+        mask: (B, H, W) bool tensor
+    Returns:
+        (B, H, W) float tensor, inf for rows without foreground
+    """
+    width = mask.shape[-1]
+    idx = torch.arange(width, device=mask.device, dtype=torch.float32).expand_as(mask)
+    inf = torch.full_like(idx, float('inf'))
+
+    # nearest foreground on the left / on the right
+    left = torch.cummax(torch.where(mask, idx, -inf), dim=-1)[0]
+    right = torch.cummin(torch.where(mask, idx, inf).flip(-1), dim=-1)[0].flip(-1)
+    return torch.min(idx - left, right - idx)
+
+def l1_distance_transform(mask):
+    """L1 (city block) distance from every pixel to the nearest foreground pixel.
+    Input:
+        mask: (B, H, W) or (H, W) foreground mask
+    Returns:
+        float tensor of the same shape, inf where the mask has no foreground
+    """
+    mask = mask > 0
+    squeeze = mask.dim() == 2
+    if squeeze:
+        mask = mask.unsqueeze(0)
+
+    # rows first, then a 1D L1 transform of the row distances along the columns:
+    # d(i) = min_k g(k) + |i - k| = min(i + min_{k<=i} g(k) - k, -i + min_{k>=i} g(k) + k)
+    g = _row_distance(mask)
+    i = torch.arange(mask.shape[1], device=mask.device, dtype=torch.float32).view(1, -1, 1)
+    up = torch.cummin(g - i, dim=1)[0] + i
+    down = torch.cummin((g + i).flip(1), dim=1)[0].flip(1) - i
+    dist = torch.min(up, down)
+
+    return dist.squeeze(0) if squeeze else dist
+
+def squared_l2_distance_transform(mask, chunk_size=32):
+    """Squared euclidean distance from every pixel to the nearest foreground pixel.
+    Input:
+        mask: (B, H, W) or (H, W) foreground mask
+        chunk_size: number of rows evaluated at once, bounds the (B, chunk, H, W) buffer
+    Returns:
+        float tensor of the same shape, inf where the mask has no foreground
+    """
+    mask = mask > 0
+    squeeze = mask.dim() == 2
+    if squeeze:
+        mask = mask.unsqueeze(0)
+
+    # separable transform: d(i, j) = min_k g(k, j)^2 + (i - k)^2
+    g2 = _row_distance(mask) ** 2
+    height = mask.shape[1]
+    k = torch.arange(height, device=mask.device, dtype=torch.float32)
+    dist = torch.empty_like(g2)
+    for start in range(0, height, chunk_size):
+        i = k[start:start + chunk_size]
+        offset = ((i.view(-1, 1) - k.view(1, -1)) ** 2).view(1, -1, height, 1)
+        dist[:, start:start + chunk_size] = torch.min(g2.unsqueeze(1) + offset, dim=2)[0]
+
+    return dist.squeeze(0) if squeeze else dist
+
+def silhouette_distance_loss(gt_mask, pred_mask, gt_distance=None):
+    """Silhouette mismatch loss.
+    Every ground-truth pixel missed by the rendered silhouette costs its L1 distance to the
+    rendered silhouette, every rendered pixel outside the ground truth costs its squared L2
+    distance to the ground truth. Samples with an empty silhouette contribute nothing to the
+    corresponding term.
+    Input:
+        gt_mask: (B, H, W) ground-truth silhouette
+        pred_mask: (B, H, W) rendered silhouette
+        gt_distance: (B, H, W) optional precomputed squared_l2_distance_transform(gt_mask)
+    Returns:
+        (B,) loss per sample
+    """
+    gt_mask = gt_mask > 0
+    pred_mask = pred_mask > 0
+    if gt_distance is None:
+        gt_distance = squared_l2_distance_transform(gt_mask)
+    pred_distance = l1_distance_transform(pred_mask)
+
+    # distances are zero on the foreground, so masking by the other silhouette picks the mismatches
+    l1 = torch.where(gt_mask & torch.isfinite(pred_distance), pred_distance, torch.zeros_like(pred_distance))
+    l2_squared = torch.where(pred_mask & torch.isfinite(gt_distance), gt_distance, torch.zeros_like(gt_distance))
+    return l1.flatten(1).sum(-1) + l2_squared.flatten(1).sum(-1)
@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 from torch.nn import functional as F
+from .amp import float32
 
 """
 Useful geometric operations, e.g. Perspective projection and a differentiable Rodrigues formula
@@ -44,6 +45,7 @@ def quat_to_rotmat(quat):
                           2*xz - 2*wy, 2*wx + 2*yz, w2 - x2 - y2 + z2], dim=1).view(B, 3, 3)
     return rotMat    
 
+@float32
 def rotation_matrix_to_angle_axis(rotation_matrix):
     """
     This function is borrowed from https://github.com/kornia/kornia
@@ -209,6 +211,7 @@ def rotation_matrix_to_quaternion(rotation_matrix, eps=1e-6):
     q *= 0.5
     return q
 
+@float32
 def rot6d_to_rotmat(x):
     """Convert 6D rotation representation to 3x3 rotation matrix.
     Based on Zhou et al., "On the Continuity of Rotation Representations in Neural Networks", CVPR 2019
@@ -226,11 +229,13 @@ def rot6d_to_rotmat(x):
     return torch.stack((b1, b2, b3), dim=-1)
 
 def projection(pred_joints, pred_camera, res, retain_z=False):
+    """Projects joints with a weak perspective camera, res is a scalar or a (B,) tensor of box sizes."""
+    res = torch.as_tensor(res, dtype=pred_joints.dtype, device=pred_joints.device).view(-1)
     pred_cam_t = torch.stack([pred_camera[:, 1],
                               pred_camera[:, 2],
                               2 * 5000. / (res * pred_camera[:, 0] + 1e-9)], dim=-1)
     batch_size = pred_joints.shape[0]
-    camera_center = torch.zeros(batch_size, 2)
+    camera_center = torch.zeros(batch_size, 2, device=pred_joints.device)
     pred_keypoints_2d = perspective_projection(pred_joints,
                                                rotation=torch.eye(3).unsqueeze(0).expand(batch_size, -1, -1).to(pred_joints.device),
                                                translation=pred_cam_t,
@@ -238,7 +243,7 @@ def projection(pred_joints, pred_camera, res, retain_z=False):
                                                camera_center=camera_center,
                                                retain_z=retain_z)
     # Normalize keypoints to [-1,1]
-    pred_keypoints_2d = pred_keypoints_2d / (res / 2.)
+    pred_keypoints_2d = pred_keypoints_2d / (res.view(-1, 1, 1) / 2.)
     return pred_keypoints_2d
 
 def perspective_projection(points, rotation, translation,
@@ -317,28 +322,50 @@ def estimate_translation_np(S, joints_2d, joints_conf, focal_length=5000, img_si
 
 def estimate_translation(S, joints_2d, focal_length=5000., img_size=224.):
     """Find camera translation that brings 3D joints S closest to 2D the corresponding joints_2d.
+    Batched version of estimate_translation_np: the 3x3 normal equations of all examples are
+    built directly and solved together on the device of S.
     Input:
         S: (B, 49, 3) 3D joint locations
         joints: (B, 49, 3) 2D joint locations and confidence
+        img_size: scalar or (B,) image sizes
     Returns:
-        (B, 3) camera translation vectors
+        (B, 3) camera translation vectors, zero for examples without confident joints
     """
 
-    device = S.device
+    dtype = S.dtype
     # Use only joints 25:49 (GT joints)
     # Use only joints 0:25 (OPENPOSE joints)
-    S = S[:, 0:25, :].cpu().numpy()
-    joints_2d = joints_2d[:, 0:25, :].cpu().numpy()
+    # float64, the entries of the normal equations scale with focal_length**2
+    S = S[:, 0:25, :].double()
+    joints_2d = joints_2d[:, 0:25, :].double()
     joints_conf = joints_2d[:, :, -1]
     joints_2d = joints_2d[:, :, :-1]
-    trans = np.zeros((S.shape[0], 3), dtype=np.float32)
-    # Find the translation for each example in the batch
-    for i in range(S.shape[0]):
-        S_i = S[i]
-        joints_i = joints_2d[i]
-        conf_i = joints_conf[i]
-        trans[i] = estimate_translation_np(S_i, joints_i, conf_i, focal_length=focal_length, img_size=img_size)
-    return torch.from_numpy(trans).to(device)
+    f = float(focal_length)
+    # optical center
+    center = torch.as_tensor(img_size, dtype=torch.float64, device=S.device).view(-1, 1, 1) / 2.
+
+    # rows of the least squares system per joint and axis: [f*e_axis, center - x] . t = (x - center) * Z - f * XY
+    a = center - joints_2d                                       # (B, 25, 2)
+    c = -a * S[:, :, 2:] - f * S[:, :, :2]                       # (B, 25, 2)
+    w = joints_conf.clamp(min=0)                                 # weight2 ** 2
+
+    # A = Q^T W Q and b = Q^T W c, summed over the joints
+    A = S.new_zeros(S.shape[0], 3, 3)
+    A[:, 0, 0] = A[:, 1, 1] = f * f * w.sum(dim=1)
+    A[:, :2, 2] = f * (w.unsqueeze(-1) * a).sum(dim=1)
+    A[:, 2, :2] = A[:, :2, 2]
+    A[:, 2, 2] = (w.unsqueeze(-1) * a * a).sum(dim=(1, 2))
+    b = torch.cat([f * (w.unsqueeze(-1) * c).sum(dim=1),
+                   (w.unsqueeze(-1) * a * c).sum(dim=(1, 2)).unsqueeze(-1)], dim=-1)
+
+    # without confident joints the system is singular, such examples get a zero translation
+    valid = w.sum(dim=1) > 0
+    eye = torch.eye(3, dtype=A.dtype, device=A.device).expand_as(A)
+    A = torch.where(valid.view(-1, 1, 1), A, eye)
+    trans, info = torch.linalg.solve_ex(A, b)
+    valid = valid & (info == 0) & torch.isfinite(trans).all(dim=-1)
+    trans = torch.where(valid.unsqueeze(-1), trans, torch.zeros_like(trans))
+    return trans.to(dtype)
 
 
 def Rot_y(angle, category='torch', prepend_dim=True, device=None):
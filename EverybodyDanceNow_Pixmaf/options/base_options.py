@@ -31,6 +31,14 @@ class BaseOptions():
         self.parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')        
         self.parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data argumentation') 
         self.parser.add_argument('--nThreads', default=2, type=int, help='# threads for loading data')                
+        self.parser.add_argument('--pin_memory', action='store_true', help='load batches into pinned host memory for asynchronous copies to the GPU')
+        self.parser.add_argument('--persistent_workers', action='store_true', help='keep the loader workers (and their frame caches) alive across epochs')
+        self.parser.add_argument('--prefetch_factor', type=int, default=2, help='batches loaded in advance by each worker')
+        self.parser.add_argument('--prefetch_device', action='store_true', help='copy the next batch to the GPU on a side stream while the current one is trained on')
+        self.parser.add_argument('--manifest', action='store_true', help='list the data folders once into [dataroot]/[phase]_manifest.json and check that they are aligned')
+        self.parser.add_argument('--frame_pack', action='store_true', help='read pre-resized frames from the packs written by data_prep/pack_frames.py')
+        self.parser.add_argument('--frame_cache_mb', type=int, default=0, help='per-worker budget of the decoded frame cache in MB, 0 disables it')
+        self.parser.add_argument('--chunk_sampler', type=int, default=0, help='if > 0, shuffle in chunks of this many consecutive frames, one chunk per loader worker, so the frame cache hits')
         self.parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
 
         # for displays
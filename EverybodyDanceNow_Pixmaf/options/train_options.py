@@ -22,6 +22,9 @@ class TrainOptions(BaseOptions):
         self.parser.add_argument('--niter_decay', type=int, default=100, help='# of iter to linearly decay learning rate to zero')
         self.parser.add_argument('--beta1', type=float, default=0.5, help='momentum term of adam')
         self.parser.add_argument('--lr', type=float, default=0.0002, help='initial learning rate for adam')
+        self.parser.add_argument('--gpu_augment', action='store_true', help='load raw uint8 frames and crop, flip and normalize whole batches on the GPU')
+        self.parser.add_argument('--amp', action='store_true', help='mixed precision: run the forward pass under autocast, SMPL, rotations, SMPLify and the renderer stay in float32')
+        self.parser.add_argument('--amp_dtype', type=str, default='float16', choices=['float16', 'bfloat16'], help='autocast dtype of --amp. float16 losses are scaled per optimizer, bfloat16 needs no scaling and also runs on the CPU')
 
         # for discriminators        
         self.parser.add_argument('--num_D', type=int, default=2, help='number of discriminators to use')
@@ -31,6 +34,7 @@ class TrainOptions(BaseOptions):
         self.parser.add_argument('--lambda_feat', type=float, default=10.0, help='weight for feature matching loss')                
         self.parser.add_argument('--no_ganFeat_loss', action='store_true', help='if specified, do *not* use discriminator feature matching loss')
         self.parser.add_argument('--no_vgg_loss', action='store_true', help='if specified, do *not* use VGG feature matching loss')        
+        self.parser.add_argument('--vgg_cache_mb', type=int, default=0, help='GPU memory budget of the cache of VGG features of the real images in MB (about 64 MB per 256x512 frame), 0 disables it')
         self.parser.add_argument('--no_lsgan', action='store_true', help='do *not* use least square GAN, if false, use vanilla GAN')
         self.parser.add_argument('--pool_size', type=int, default=0, help='the size of image buffer that stores previously generated images')
 
@@ -47,7 +51,11 @@ class TrainOptions(BaseOptions):
         pixmaf.add_argument('--cfg_file', type=str, default=None, help='config file path for PixMAF.')
         pixmaf.add_argument('--lr_Dmotion', type=float, default=0.0001, help='initial learning rate for adam')
         pixmaf.add_argument('--run_smplify', default=False, action='store_true', help='run SMPLify during training')
+        pixmaf.add_argument('--async_smplify', default=False, action='store_true', help='with --run_smplify, refine the best fits on a background thread instead of inside the training step')
         pixmaf.add_argument('--use_silhouette', default=False, action='store_true', help='use silhouette loss during training')
+        pixmaf.add_argument('--param_fields', type=str, default='', help='comma separated other_params fields to load, e.g. bboxes,frame_ids,openpose_kp_2d,verts. Derived from the enabled losses if empty')
+        pixmaf.add_argument('--vibe_mmap', default=False, action='store_true', help='memory-map the per-field VIBE arrays written by data_prep/convert_vibe.py instead of loading train_vibe.pkl')
+        pixmaf.add_argument('--silhouette_cache', default=False, action='store_true', help='load silhouettes and their distance fields from the .npy built by data_prep/pack_silhouettes.py')
         pixmaf.add_argument('--use_shapeCoherence', default=False, action='store_true', help='use shape coherence loss during training')
         
         self.isTrain = True
@@ -0,0 +1,75 @@
+import os
+import sys
+import pytest
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+from models.pixmaf_net.utils.geometry import rot6d_to_rotmat, rotation_matrix_to_angle_axis
+
+"""
+Checks that the float32-decorated parts of the model run in float32 under --amp --amp_dtype bfloat16,
+on the CPU: their outputs are float32 and close to a float32 run without autocast.
+Run from the repository root: python -m pytest tests
+"""
+
+def bf16_autocast():
+    return torch.autocast('cpu', dtype=torch.bfloat16)
+
+def half_precision_input(batch_size, dim, seed=0):
+    """A bfloat16 activation, as the regressor layers produce it under autocast."""
+    generator = torch.Generator().manual_seed(seed)
+    layer = torch.nn.Linear(16, dim)
+    with torch.no_grad():
+        layer.weight.copy_(torch.randn(dim, 16, generator=generator) * 0.1)
+        with bf16_autocast():
+            x = layer(torch.randn(batch_size, 16, generator=generator))
+    assert x.dtype == torch.bfloat16
+    return x
+
+@pytest.fixture
+def repo_root(monkeypatch):
+    # the SMPL and prior data paths are relative to the repository root
+    monkeypatch.chdir(ROOT)
+
+def test_rot6d_to_rotmat():
+    x = half_precision_input(8, 6)
+    with bf16_autocast():
+        rotmat = rot6d_to_rotmat(x)
+    assert rotmat.dtype == torch.float32
+    assert torch.allclose(rotmat, rot6d_to_rotmat(x.float()), atol=1e-6)
+
+def test_rotation_matrix_to_angle_axis():
+    rotmat = rot6d_to_rotmat(half_precision_input(8, 6).float())
+    rotmat = torch.cat([rotmat, torch.zeros(8, 3, 1)], dim=2).bfloat16()
+    with bf16_autocast():
+        angle_axis = rotation_matrix_to_angle_axis(rotmat)
+    assert angle_axis.dtype == torch.float32
+    assert torch.allclose(angle_axis, rotation_matrix_to_angle_axis(rotmat.float()), atol=1e-5)
+
+def test_pose_prior(repo_root):
+    pytest.importorskip('smplx')
+    from models.pixmaf_net.smplify.prior import MaxMixturePrior
+    prior = MaxMixturePrior(prior_folder='pixmaf_data', num_gaussians=8)
+    pose = half_precision_input(4, 69)
+    betas = torch.zeros(4, 10)
+    with bf16_autocast():
+        loss = prior(pose, betas)
+    assert loss.dtype == torch.float32
+    assert torch.allclose(loss, prior(pose.float(), betas), rtol=1e-5)
+
+def test_smpl_forward(repo_root):
+    pytest.importorskip('smplx')
+    if not os.path.isdir(os.path.join(ROOT, 'pixmaf_data', 'smpl')):
+        pytest.skip('SMPL model files are missing')
+    from models.pixmaf_net.models.smpl import get_smpl
+    smpl = get_smpl('cpu')
+    body_pose = rot6d_to_rotmat(half_precision_input(4 * 23, 6).float()).view(4, 23, 3, 3)
+    global_orient = torch.eye(3).expand(4, 1, 3, 3)
+    betas = half_precision_input(4, 10, seed=1)
+    with bf16_autocast():
+        output = smpl(betas=betas, body_pose=body_pose, global_orient=global_orient, pose2rot=False)
+    reference = smpl(betas=betas.float(), body_pose=body_pose, global_orient=global_orient, pose2rot=False)
+    assert output.vertices.dtype == output.joints.dtype == torch.float32
+    assert torch.allclose(output.vertices, reference.vertices, atol=1e-5)
+    assert torch.allclose(output.joints, reference.joints, atol=1e-5)
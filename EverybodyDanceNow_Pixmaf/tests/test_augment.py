@@ -0,0 +1,73 @@
+import os
+import sys
+from types import SimpleNamespace
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.base_dataset import get_transform, resize_frame, augment_frames, augment_batch
+
+"""
+Checks the batched crop/flip/normalize of --gpu_augment, on the CPU, against the per-sample
+get_transform pipeline it replaces.
+Run from the repository root: python -m pytest tests
+"""
+
+def make_opt(fine_size=48):
+    # frames are resized to 96 x 57
+    return SimpleNamespace(resize_or_crop='scale_width_and_crop', loadSize=96, fineSize=fine_size, isTrain=True, no_flip=False)
+
+def random_images(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return [Image.fromarray(rng.randint(0, 255, (72, 120, 3), dtype=np.uint8)) for _ in range(n)]
+
+def raw_frames(opt, images, method=Image.BICUBIC):
+    """The uint8 frames the dataset yields with --gpu_augment."""
+    return torch.stack([torch.from_numpy(np.array(resize_frame(opt, img, method))).permute(2, 0, 1) for img in images])
+
+# fixed crop positions, inside the frame and at the far corner get_params can give, with and without flip
+PARAMS = [{'crop_pos': (0, 0), 'flip': False}, {'crop_pos': (13, 7), 'flip': True},
+          {'crop_pos': (48, 9), 'flip': False}, {'crop_pos': (48, 9), 'flip': True}]
+
+def collate(params):
+    return {'crop_pos': torch.IntTensor([p['crop_pos'] for p in params]),
+            'flip': torch.tensor([p['flip'] for p in params])}
+
+def test_augment_frames():
+    opt = make_opt()
+    images = random_images(len(PARAMS))
+    frames = raw_frames(opt, images)
+    for normalize in (True, False):
+        out = augment_frames(opt, frames, collate(PARAMS), normalize=normalize)
+        expected = torch.stack([get_transform(opt, p, normalize=normalize)(img) for img, p in zip(images, PARAMS)])
+        assert out.shape == expected.shape
+        assert torch.allclose(out, expected, atol=1e-6)
+
+def test_augment_frames_padded():
+    # crops taller than the frame, PIL pads them with zeros
+    opt = make_opt(fine_size=64)
+    params = [{'crop_pos': (0, 0), 'flip': True}, {'crop_pos': (32, 0), 'flip': False}]
+    images = random_images(len(params))
+    out = augment_frames(opt, raw_frames(opt, images), collate(params))
+    expected = torch.stack([get_transform(opt, p)(img) for img, p in zip(images, params)])
+    assert out.shape == expected.shape
+    assert torch.allclose(out, expected, atol=1e-6)
+
+def test_augment_batch():
+    opt = make_opt()
+    labels, images = random_images(len(PARAMS), seed=1), random_images(len(PARAMS), seed=2)
+    next_labels, next_images = random_images(len(PARAMS), seed=3), random_images(len(PARAMS), seed=4)
+    next_params = PARAMS[::-1]
+    data = {'label': raw_frames(opt, labels, Image.NEAREST), 'image': raw_frames(opt, images),
+            'next_label': raw_frames(opt, next_labels, Image.NEAREST), 'next_image': raw_frames(opt, next_images),
+            'crop_params': collate(PARAMS), 'next_crop_params': collate(next_params)}
+    data = augment_batch(opt, data, device='cpu')
+    assert 'crop_params' not in data and 'next_crop_params' not in data
+
+    for key, imgs, params, method, normalize in (('label', labels, PARAMS, Image.NEAREST, False),
+                                                 ('image', images, PARAMS, Image.BICUBIC, True),
+                                                 ('next_label', next_labels, next_params, Image.NEAREST, False),
+                                                 ('next_image', next_images, next_params, Image.BICUBIC, True)):
+        expected = torch.stack([get_transform(opt, p, method=method, normalize=normalize)(img) for img, p in zip(imgs, params)])
+        assert torch.allclose(data[key], expected, atol=1e-6), key
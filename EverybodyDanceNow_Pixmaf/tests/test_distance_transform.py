@@ -0,0 +1,91 @@
+import os
+import sys
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models.pixmaf_net.utils.distance_transform import l1_distance_transform, squared_l2_distance_transform, \
+    silhouette_distance_loss
+
+"""
+Checks the batched distance transforms against the per-pixel loop that get_silhouette_loss used before.
+Run from the repository root: python -m pytest tests
+"""
+
+def _caldist_squared_l2(pt, pts):
+    return torch.min(torch.sum((pts - pt) * (pts - pt), dim=1))
+
+def _caldist_l1(pt, pts):
+    return torch.min(torch.sum(torch.abs(pts - pt), dim=1))
+
+def loop_silhouette_loss(crop_img, silhouettes_img):
+    """The old per-pixel loop of get_silhouette_loss for one (H, W) pair, returns (l1, l2_squared)."""
+    crop_img_index = (crop_img > 0).nonzero(as_tuple=False)
+    silhouettes_img_index = (silhouettes_img > 0).nonzero(as_tuple=False)
+    diff_index = (((crop_img > 0) == (silhouettes_img > 0)) == 0).nonzero(as_tuple=False)
+
+    l1 = 0.
+    l2_squared = 0.
+    for i in range(diff_index.shape[0]):
+        a = crop_img[diff_index[i][0], diff_index[i][1]]
+        b = silhouettes_img[diff_index[i][0], diff_index[i][1]]
+        if a != 0 and b == 0:
+            try:
+                l1 += float(_caldist_l1(diff_index[i].float(), silhouettes_img_index.float()))
+            except (RuntimeError, IndexError):
+                break
+        elif a == 0 and b != 0:
+            try:
+                l2_squared += float(_caldist_squared_l2(diff_index[i].float(), crop_img_index.float()))
+            except (RuntimeError, IndexError):
+                break
+    return l1, l2_squared
+
+def loop_distance_transform(mask, dist):
+    """Distance of every pixel to the nearest foreground pixel, one pixel at a time."""
+    pts = (mask > 0).nonzero(as_tuple=False).float()
+    out = torch.full(mask.shape, float('inf'))
+    if len(pts) == 0:
+        return out
+    for i in range(mask.shape[0]):
+        for j in range(mask.shape[1]):
+            out[i, j] = dist(torch.tensor([i, j]).float(), pts)
+    return out
+
+def random_masks(batch_size=4, height=13, width=17, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    masks = torch.rand(batch_size, height, width, generator=generator) > 0.8
+    # empty and full masks
+    masks[1] = False
+    masks[2] = True
+    return masks
+
+def test_l1_distance_transform():
+    masks = random_masks()
+    dist = l1_distance_transform(masks)
+    for mask, d in zip(masks, dist):
+        assert torch.equal(d, loop_distance_transform(mask, _caldist_l1))
+    # unbatched input
+    assert torch.equal(l1_distance_transform(masks[0]), dist[0])
+
+def test_squared_l2_distance_transform():
+    masks = random_masks()
+    for chunk_size in (1, 5, 32):
+        dist = squared_l2_distance_transform(masks, chunk_size=chunk_size)
+        for mask, d in zip(masks, dist):
+            assert torch.equal(d, loop_distance_transform(mask, _caldist_squared_l2))
+
+def test_silhouette_distance_loss():
+    a = random_masks(seed=1)[0]
+    b = random_masks(seed=2)[0]
+    empty = torch.zeros_like(a)
+    full = torch.ones_like(a)
+    # (ground truth, rendered) pairs: random, empty and full silhouettes
+    pairs = [(a, b), (b, a), (a, empty), (empty, a), (full, a), (a, full), (empty, empty)]
+    gt = torch.stack([g for g, _ in pairs])
+    pred = torch.stack([p for _, p in pairs])
+    loss = silhouette_distance_loss(gt, pred)
+    precomputed = silhouette_distance_loss(gt, pred, gt_distance=squared_l2_distance_transform(gt))
+    assert torch.equal(loss, precomputed)
+    for g, p, l in zip(gt, pred, loss):
+        l1, l2_squared = loop_silhouette_loss(g, p)
+        assert abs(float(l) - (l1 + l2_squared)) < 1e-3
@@ -0,0 +1,59 @@
+import os
+import sys
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models.pixmaf_net.utils.geometry import estimate_translation, estimate_translation_np
+
+"""
+Checks the batched estimate_translation against the per-example NumPy version it replaced.
+Run from the repository root: python -m pytest tests
+"""
+
+def random_inputs(batch_size=6, focal_length=5000., seed=0):
+    rng = np.random.RandomState(seed)
+    img_size = rng.uniform(150., 400., batch_size)
+    S = rng.randn(batch_size, 49, 3) * 0.5
+    trans = np.stack([rng.uniform(-0.3, 0.3, batch_size), rng.uniform(-0.3, 0.3, batch_size),
+                      rng.uniform(20., 60., batch_size)], axis=-1)
+    # perspective projection with noise
+    points = S + trans[:, None]
+    joints_2d = focal_length * points[:, :, :2] / points[:, :, 2:] + img_size[:, None, None] / 2.
+    joints_2d += rng.randn(*joints_2d.shape)
+    conf = rng.uniform(0., 1., (batch_size, 49, 1)) * (rng.uniform(size=(batch_size, 49, 1)) > 0.3)
+    return S, np.concatenate([joints_2d, conf], axis=-1), img_size
+
+def test_matches_numpy():
+    focal_length = 5000.
+    S, joints_2d, img_size = random_inputs(focal_length=focal_length)
+    trans = estimate_translation(torch.from_numpy(S).float(), torch.from_numpy(joints_2d).float(),
+                                 focal_length=focal_length, img_size=torch.from_numpy(img_size).float())
+    assert trans.dtype == torch.float32
+    for i in range(len(S)):
+        expected = estimate_translation_np(S[i, :25].astype(np.float32), joints_2d[i, :25, :2].astype(np.float32),
+                                           joints_2d[i, :25, 2].astype(np.float32),
+                                           focal_length=focal_length, img_size=np.float32(img_size[i]))
+        assert np.allclose(trans[i].numpy(), expected, rtol=1e-4, atol=1e-4)
+
+def test_scalar_img_size():
+    S, joints_2d, _ = random_inputs(seed=1)
+    S, joints_2d = torch.from_numpy(S).float(), torch.from_numpy(joints_2d).float()
+    scalar = estimate_translation(S, joints_2d, img_size=224.)
+    batched = estimate_translation(S, joints_2d, img_size=torch.full((len(S),), 224.))
+    assert torch.allclose(scalar, batched)
+
+def test_zero_confidence():
+    S, joints_2d, img_size = random_inputs(seed=2)
+    joints_2d[1, :25, 2] = 0.
+    trans = estimate_translation(torch.from_numpy(S).float(), torch.from_numpy(joints_2d).float(),
+                                 img_size=torch.from_numpy(img_size).float())
+    # the NumPy version has no solution here
+    try:
+        estimate_translation_np(S[1, :25], joints_2d[1, :25, :2], joints_2d[1, :25, 2], img_size=img_size[1])
+        singular = False
+    except np.linalg.LinAlgError:
+        singular = True
+    assert singular
+    assert torch.equal(trans[1], torch.zeros(3))
+    assert (trans[[0, 2, 3, 4, 5], 2] > 0).all()
@@ -0,0 +1,39 @@
+import os
+import sys
+import pytest
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+"""
+Checks that the pose/betas/vertex losses of the two stacked frames are the mean of the per-frame
+losses, as when get_losses ran once per frame.
+Run from the repository root: python -m pytest tests
+"""
+
+@pytest.fixture
+def criterion():
+    for module in ('yacs', 'smplx', 'neural_renderer'):
+        pytest.importorskip(module)
+    from models.pixmaf_net.models.networks import Pixmaf_Loss
+    return Pixmaf_Loss(device='cpu')
+
+def random_fits(batch_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    randn = lambda *size: torch.randn(*size, generator=generator)
+    return randn(batch_size, 24, 3, 3), randn(batch_size, 10), 0.3 * randn(batch_size, 72), randn(batch_size, 10), \
+        randn(batch_size, 30, 3), randn(batch_size, 30, 3)
+
+@pytest.mark.parametrize('valid', [[1, 0, 0, 0, 1, 1, 1, 0], [0, 0, 0, 0, 1, 1, 0, 1], [1, 1, 1, 1, 1, 1, 1, 1]])
+def test_per_frame_mean(criterion, valid):
+    pred_rotmat, pred_betas, opt_pose, opt_betas, pred_vertices, opt_vertices = random_fits(len(valid))
+    valid_fit = torch.tensor(valid, dtype=torch.bool)
+    half = len(valid) // 2
+
+    pose, betas = criterion.smpl_losses(pred_rotmat, pred_betas, opt_pose, opt_betas, valid_fit, n_frames=2)
+    shape = criterion.shape_loss(pred_vertices, opt_vertices, valid_fit, n_frames=2)
+    frames = [slice(0, half), slice(half, None)]
+    per_frame = [criterion.smpl_losses(pred_rotmat[f], pred_betas[f], opt_pose[f], opt_betas[f], valid_fit[f]) for f in frames]
+    assert torch.allclose(pose, (per_frame[0][0] + per_frame[1][0]) * 0.5)
+    assert torch.allclose(betas, (per_frame[0][1] + per_frame[1][1]) * 0.5)
+    assert torch.allclose(shape, sum(criterion.shape_loss(pred_vertices[f], opt_vertices[f], valid_fit[f]) for f in frames) * 0.5)
@@ -0,0 +1,62 @@
+import os
+import sys
+import pytest
+import torch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+
+"""
+Checks the partial SMPL evaluations against the full SMPL forward.
+Needs smplx and the SMPL model files in pixmaf_data/smpl, skipped otherwise.
+Run from the repository root: python -m pytest tests
+"""
+
+@pytest.fixture
+def smpl(monkeypatch):
+    pytest.importorskip('smplx')
+    if not os.path.isdir(os.path.join(ROOT, 'pixmaf_data', 'smpl')):
+        pytest.skip('SMPL model files are missing')
+    # the SMPL data paths are relative to the repository root
+    monkeypatch.chdir(ROOT)
+    from models.pixmaf_net.models.smpl import get_smpl
+    return get_smpl('cpu')
+
+def random_params(batch_size=5, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    global_orient = 0.5 * torch.randn(batch_size, 3, generator=generator)
+    body_pose = 0.3 * torch.randn(batch_size, 69, generator=generator)
+    betas = torch.randn(batch_size, 10, generator=generator)
+    return global_orient, body_pose, betas
+
+def test_joints_only(smpl):
+    global_orient, body_pose, betas = random_params()
+    full = smpl(betas=betas, body_pose=body_pose, global_orient=global_orient)
+    partial = smpl(betas=betas, body_pose=body_pose, global_orient=global_orient, joints_only=True)
+    assert partial.vertices is None
+    assert partial.joints.shape == full.joints.shape == (5, 49, 3)
+    assert torch.allclose(partial.joints, full.joints, atol=1e-5)
+    assert torch.allclose(partial.smpl_joints, full.smpl_joints, atol=1e-5)
+    assert torch.allclose(partial.joints_J19, full.joints_J19, atol=1e-5)
+
+@pytest.mark.parametrize('joints_only', [False, True])
+def test_fitting_smpl(smpl, joints_only):
+    from models.pixmaf_net.models.smpl import FittingSMPL
+    fitting_smpl = FittingSMPL(smpl)
+    global_orient, body_pose, betas = random_params(seed=1)
+    components = None
+    for step in range(3):
+        if step == 2:
+            # in place update of the cached betas
+            betas.add_(0.5)
+        full = smpl(betas=betas, body_pose=body_pose, global_orient=global_orient)
+        vertices, joints = fitting_smpl(global_orient, body_pose, betas, joints_only=joints_only)
+        if joints_only:
+            assert vertices is None
+        else:
+            assert torch.allclose(vertices, full.vertices, atol=1e-5)
+        assert torch.allclose(joints, full.joints, atol=1e-5)
+        # the betas part is cached while the pose changes, recomputed after the betas change
+        assert (fitting_smpl.cache[3] is components) == (step == 1)
+        components = fitting_smpl.cache[3]
+        body_pose = body_pose + 0.1
@@ -0,0 +1,70 @@
+import os
+import sys
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch.utils.data.dataloader import default_collate
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data.aligned_dataset import AlignedDataset
+
+"""
+Checks that the VGG feature cache keys of a collated batch stay on the host, out of the
+other_params that encode_input moves to the device.
+Run from the repository root: python -m pytest tests
+"""
+
+def make_dataset(tmpdir, n=3, face_discrim=True):
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(n):
+        path = os.path.join(str(tmpdir), '%d.png' % i)
+        Image.fromarray(rng.randint(0, 255, (64, 96, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+
+    opt = SimpleNamespace(isTrain=True, resize_or_crop='scale_width_and_crop', loadSize=96, fineSize=48,
+                          no_flip=False, frame_pack=False, gestures=False, face_discrim=face_discrim,
+                          face_generator=False)
+    dataset = AlignedDataset.__new__(AlignedDataset)
+    dataset.opt = opt
+    dataset.frame_cache = None
+    dataset.gpu_augment = False
+    dataset.frame_keys = True
+    dataset.label_paths = dataset.image_paths = paths
+    dataset.param_fields = ['frame_ids', 'bboxes']
+    dataset.stage = 'local'
+    dataset.vibe = {'frame_ids': np.arange(n), 'bboxes': rng.uniform(10, 40, (n, 4))}
+    dataset.face_boxes = np.array([[4 + i, 20 + i, 8, 24] for i in range(n)], dtype=np.int32)
+    return dataset
+
+def test_collated_keys(tmpdir):
+    dataset = make_dataset(tmpdir)
+    batch = default_collate([dataset[0], dataset[1]])
+
+    for params in (batch['other_params'], batch['next_other_params']):
+        assert all(torch.is_tensor(v) for v in params.values())
+    keys = batch['vgg_keys']
+    assert len(keys['frame']) == len(keys['next_frame']) == len(keys['face']) == 2
+    assert all(isinstance(k, str) for k in keys['frame'] + keys['next_frame'] + keys['face'])
+    assert keys['frame'][0].split(':')[0] == '0' and keys['next_frame'][0].split(':')[0] == '1'
+    assert keys['face'] == [':face:4:20:8:24', ':face:5:21:8:24']
+
+def test_encode_input(tmpdir):
+    pytest.importorskip('yacs')
+    pytest.importorskip('smplx')
+    if not torch.cuda.is_available():
+        pytest.skip('encode_input moves the batch to cuda')
+    from models.pix2pixHD_model_fullts import Pix2PixHDModel
+
+    dataset = make_dataset(tmpdir)
+    batch = default_collate([dataset[0], dataset[1]])
+    model = Pix2PixHDModel.__new__(Pix2PixHDModel)
+    _, real_image, _, next_image, _, other_params, next_other_params = model.encode_input(
+        batch['label'], batch['image'], next_label=batch['next_label'], next_image=batch['next_image'],
+        zeroshere=torch.zeros_like(batch['label']),
+        other_params=batch['other_params'], next_other_params=batch['next_other_params'])
+    assert real_image.is_cuda and next_image.is_cuda
+    assert set(other_params) == {'frame_ids', 'bboxes'}
+    assert all(v.is_cuda for v in list(other_params.values()) + list(next_other_params.values()))
@@ -17,6 +17,8 @@ import pickle
 
 from models.pixmaf_net.core.cfgs import cfg,parse_args_extend
 from models.pixmaf_net.models.networks import render_smpl, move_dict_to_device
+from models.pixmaf_net.utils.amp import grad_scaler
+from data.base_dataset import augment_batch
 
 opt = TrainOptions().parse()
 parse_args_extend(opt)
@@ -61,6 +63,14 @@ model = create_model_fullts(opt)
 model.train()
 visualizer = Visualizer(opt)
 
+# mixed precision, one loss scaler per optimizer. bfloat16 has the range of float32 and needs no scaling
+amp_device = 'cuda' if len(opt.gpu_ids) > 0 else 'cpu'
+amp_dtype = getattr(torch, opt.amp_dtype)
+use_scaler = opt.amp and amp_dtype == torch.float16
+scaler_G = grad_scaler(amp_device, use_scaler)
+scaler_D = grad_scaler(amp_device, use_scaler)
+scaler_D_wo_motion = grad_scaler(amp_device, use_scaler)
+
 total_steps = (start_epoch-1) * dataset_size + epoch_iter    
 for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
     epoch_start_time = time.time()
@@ -82,6 +92,10 @@ for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
         # whether to collect output images
         save_fake = total_steps % opt.display_freq == 0
 
+        if opt.gpu_augment:
+            # crop, flip and normalize the raw uint8 frames on the device
+            augment_batch(opt, data, cfg.DEVICE)
+
         ############## Forward Pass ######################
 
         # 测试dataset
@@ -126,9 +140,11 @@ for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
         if no_nexts:
             cond_zeros = torch.zeros(data['label'].size()).float()
 
-            losses, generated = model(Variable(data['label']), Variable(data['next_label']), Variable(data['image']), \
-                    Variable(data['next_image']), Variable(data['face_coords']), Variable(cond_zeros), \
-                    data['other_params'], data['next_other_params'], real_motion_samples, infer=True)
+            with torch.autocast(amp_device, dtype=amp_dtype, enabled=opt.amp):
+                losses, generated = model(Variable(data['label']), Variable(data['next_label']), Variable(data['image']), \
+                        Variable(data['next_image']), Variable(data['face_coords']), Variable(cond_zeros), \
+                        data['other_params'], data['next_other_params'], real_motion_samples, \
+                        vgg_keys=data.get('vgg_keys'), infer=True)
 
             # sum per device losses
             losses = [ torch.mean(x) if not isinstance(x, int) else x for x in losses ]
@@ -152,19 +168,23 @@ for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
 
             ############### Backward Pass ####################
             # update generator weights
+            # the scalers are pass-throughs without --amp float16
             model.module.optimizer_G.zero_grad()
-            loss_G.backward()
-            model.module.optimizer_G.step()
+            scaler_G.scale(loss_G).backward()
+            scaler_G.step(model.module.optimizer_G)
+            scaler_G.update()
 
             # update discriminator weights
             if total_steps % cfg.TRAIN.MOT_DISCR.UPDATE_STEPS == 0:
                 model.module.optimizer_D.zero_grad()
-                loss_D.backward()
-                model.module.optimizer_D.step()
+                scaler_D.scale(loss_D).backward()
+                scaler_D.step(model.module.optimizer_D)
+                scaler_D.update()
             else:
                 model.module.optimizer_D_wo_motion.zero_grad()
-                loss_D.backward()
-                model.module.optimizer_D_wo_motion.step()
+                scaler_D_wo_motion.scale(loss_D).backward()
+                scaler_D_wo_motion.step(model.module.optimizer_D_wo_motion)
+                scaler_D_wo_motion.update()
 
             #call(["nvidia-smi", "--format=csv", "--query-gpu=memory.used,memory.free"]) 
 
@@ -180,6 +200,12 @@ for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
                 t = (time.time() - iter_start_time) / opt.batchSize
                 visualizer.print_current_errors(epoch, epoch_iter, errors, t)
                 visualizer.plot_current_errors(errors, total_steps)
+                # the background SMPLify only exists with --use_pixmaf --run_smplify --async_smplify
+                refiner = getattr(model.module, 'refiner', None)
+                if refiner is not None:
+                    smplify_metrics = refiner.metrics()
+                    print('async SMPLify: ' + ', '.join('%s %g' % (k, v) for k, v in sorted(smplify_metrics.items())))
+                    visualizer.plot_current_errors({'smplify/' + k: v for k, v in smplify_metrics.items()}, total_steps)
 
             ### display output images
             if save_fake:
@@ -224,11 +250,10 @@ for epoch in range(start_epoch, opt.niter + opt.niter_decay + 1):
             model.module.save('latest')            
             np.savetxt(iter_path, (epoch, epoch_iter), delimiter=',', fmt='%d')
             
-            file_best_fits = os.path.join(opt.dataroot, 'best_fits.pkl')  
-            with open(file_best_fits,'wb') as f:
-                pickle.dump(model.module.best_fits,f,pickle.HIGHEST_PROTOCOL)
+            # only the best fits updated since the last save are written
+            num_flushed = model.module.best_fits.flush()
 
-            print('At steps: %d, Update OPT data %d times'%(total_steps,model.module.countOPT))
+            print('At steps: %d, Update OPT data %d times, %d best fits saved'%(total_steps,int(model.module.countOPT),num_flushed))
 
     # end of epoch  
     iter_end_time = time.time()